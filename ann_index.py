@@ -0,0 +1,97 @@
+"""IVF (inverted file) approximate nearest-neighbour index in pure NumPy.
+
+A k-means coarse quantizer splits the normalized embedding rows into lists; a
+query scores the centroids, probes the ``nprobe`` closest lists and scores only
+their members exactly. Lists are stored CSR-style: the members of list ``l`` are
+``order[offsets[l]:offsets[l + 1]]``.
+"""
+
+from __future__ import annotations
+
+import math
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 12
+TRAIN_POINTS_PER_LIST = 64
+ASSIGN_BLOCK_ROWS = 65536
+
+
+def default_list_count(rows: int) -> int:
+    """Roughly sqrt(N) lists, the usual IVF starting point."""
+    return max(1, int(round(math.sqrt(rows))))
+
+
+def _nearest_centroid(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignments = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], ASSIGN_BLOCK_ROWS):
+        block = np.asarray(vectors[start : start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+        assignments[start : start + block.shape[0]] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(
+    vectors: np.ndarray,
+    n_lists: int,
+    iterations: int = KMEANS_ITERATIONS,
+    seed: int = 0,
+) -> np.ndarray:
+    """Spherical k-means on a random sample of the rows."""
+    rng = np.random.default_rng(seed)
+    rows = vectors.shape[0]
+    n_lists = min(n_lists, rows)
+    sample_size = min(rows, n_lists * TRAIN_POINTS_PER_LIST)
+    sample = np.asarray(vectors[np.sort(rng.choice(rows, size=sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(sample_size, size=n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = _nearest_centroid(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=n_lists)
+        empty = counts == 0
+        # Reseed empty lists from random sample points so every list stays useful
+        sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        centroids = sums / norms
+    return centroids.astype(np.float32)
+
+
+def build_ivf(vectors: np.ndarray, n_lists: Optional[int] = None, seed: int = 0) -> Dict[str, np.ndarray]:
+    n_lists = n_lists or default_list_count(vectors.shape[0])
+    centroids = train_centroids(vectors, n_lists, seed=seed)
+    assignments = _nearest_centroid(vectors, centroids)
+    order = np.argsort(assignments, kind="stable").astype(np.int32)
+    offsets = np.zeros(centroids.shape[0] + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assignments, minlength=centroids.shape[0]))
+    return {"centroids": centroids, "order": order, "offsets": offsets}
+
+
+def save_ivf(index: Dict[str, np.ndarray], path: Path) -> None:
+    with path.open("wb") as f:
+        np.savez(f, **index)
+
+
+def load_ivf(path: Path) -> Dict[str, np.ndarray]:
+    with np.load(path, allow_pickle=False) as archive:
+        return {key: archive[key] for key in archive.files}
+
+
+def probe_lists(index: Dict[str, np.ndarray], queries: np.ndarray, nprobe: int) -> np.ndarray:
+    """The ``nprobe`` closest lists per query row, shape (queries x nprobe)."""
+    centroid_scores = queries @ index["centroids"].T
+    nprobe = min(nprobe, centroid_scores.shape[1])
+    if nprobe == centroid_scores.shape[1]:
+        return np.broadcast_to(np.arange(nprobe), centroid_scores.shape)
+    return np.argpartition(centroid_scores, -nprobe, axis=1)[:, -nprobe:]
+
+
+def list_members(index: Dict[str, np.ndarray], lists: np.ndarray) -> np.ndarray:
+    """Sorted row ids belonging to any of ``lists``."""
+    offsets = index["offsets"]
+    members = [index["order"][offsets[l] : offsets[l + 1]] for l in lists]
+    return np.sort(np.concatenate(members)) if members else np.zeros(0, dtype=np.int32)
@@ -5,11 +5,13 @@ import openai
 import requests
 import base64
 import os
+import re
 from dotenv import load_dotenv
 import time
 from pathlib import Path
 from html import escape
 
+import embedding_cache
 import knowledge_base
 
 EXCERPT_SOURCES = {
@@ -168,6 +170,17 @@ openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 ELEVENLABS_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID")
 CORPUS_EMBEDDING_MODEL = os.getenv("CORPUS_EMBEDDING_MODEL", "text-embedding-3-large")
+# Truncated query width; 0 asks for whatever width the loaded index stores
+CORPUS_EMBEDDING_DIMENSIONS = int(os.getenv("CORPUS_EMBEDDING_DIMENSIONS", "0"))
+# Comma-separated collections retrieval may cite (e.g. "public_domain"); empty means all
+CORPUS_COLLECTIONS = [name.strip() for name in os.getenv("CORPUS_COLLECTIONS", "").split(",") if name.strip()]
+CORPUS_FILTERS = {"collection": CORPUS_COLLECTIONS} if CORPUS_COLLECTIONS else None
+# Overlapping chunks and duplicated speeches otherwise fill the context with repeats
+REFERENCE_MMR_LAMBDA = 0.5
+REFERENCE_MAX_PER_SOURCE = 2
+# Word budget per excerpt when hits are merged with neighbouring chunks so anecdotes
+# are not cut mid-story; 0 sends bare hits trimmed to knowledge_base.REFERENCE_SNIPPET_CHARS
+CORPUS_CONTEXT_WORDS = int(os.getenv("CORPUS_CONTEXT_WORDS", "400"))
 
 def get_vonnegut_system_prompt(educational_mode=False, passage_context=None):
     """Generate comprehensive system prompt with optional educational enhancement"""
@@ -484,21 +497,66 @@ def display_reading_text(text_content, component_key="reading_pane"):
 
 
 
+def open_work_title():
+    """Title of the library text in the reading pane, e.g. "2BR02B (1962)" -> "2BR02B"."""
+    selected = st.session_state.get("text_selector") or ""
+    if not selected or selected.startswith("--"):
+        return None
+    return re.sub(r"\s*\([^)]*\)\s*$", "", selected)
+
+
 def fetch_reference_snippets(query_text, top_k=3):
     if not knowledge_base.index_available():
         return []
 
-    try:
-        embedding = openai_client.embeddings.create(
-            model=CORPUS_EMBEDDING_MODEL,
-            input=[query_text]
-        ).data[0].embedding
-    except Exception as exc:
-        # Surface failure once per rerun via Streamlit, but avoid breaking chats
-        st.warning(f"Corpus retrieval unavailable: {exc}")
-        return []
+    work_title = open_work_title()
+    search_options = {
+        "top_k": top_k,
+        "filters": CORPUS_FILTERS,
+        "boost": {"title": work_title} if work_title else None,
+        "mmr_lambda": REFERENCE_MMR_LAMBDA,
+        "max_per_source": REFERENCE_MAX_PER_SOURCE,
+        "expand_words": CORPUS_CONTEXT_WORDS or None,
+    }
 
-    return knowledge_base.search_by_embedding(embedding, top_k=top_k)
+    # Only text-embedding-3 models accept a dimensions argument
+    dimensions = CORPUS_EMBEDDING_DIMENSIONS or knowledge_base.index_dimensions()
+    embed_options = {"dimensions": dimensions} if dimensions and "embedding-3" in CORPUS_EMBEDDING_MODEL else {}
+    cache_model = f"{CORPUS_EMBEDDING_MODEL}@{embed_options['dimensions']}" if embed_options else CORPUS_EMBEDDING_MODEL
+
+    # Quick actions repeat the same text, so most turns skip the embeddings call entirely
+    cache = embedding_cache.get_query_cache()
+    local_embedder = knowledge_base.query_embedder()
+    if local_embedder is not None:
+        # Index built with the local provider: embedding the query is a sub-millisecond lookup
+        embedding = local_embedder.embed([query_text])[0]
+    else:
+        embedding = cache.get_embedding(cache_model, query_text)
+    if embedding is None:
+        try:
+            embedding = openai_client.embeddings.create(
+                model=CORPUS_EMBEDDING_MODEL,
+                input=[query_text],
+                **embed_options
+            ).data[0].embedding
+        except Exception as exc:
+            # Surface failure once per rerun via Streamlit, but keep exact-phrase lookups working
+            st.warning(f"Semantic retrieval unavailable, using keyword search: {exc}")
+            return knowledge_base.search_lexical(
+                query_text, top_k=top_k, filters=CORPUS_FILTERS, expand_words=CORPUS_CONTEXT_WORDS or None
+            )
+        cache.put_embedding(cache_model, query_text, embedding)
+
+    results_key = embedding_cache.results_key(
+        embedding,
+        query_text,
+        {**search_options, "index": knowledge_base.index_version()},
+    )
+    snippets = cache.get_results(results_key)
+    if snippets is None:
+        snippets = knowledge_base.search_hybrid(query_text, embedding, **search_options)
+        cache.put_results(results_key, snippets)
+    return snippets
 
 
 def build_reference_context(user_input, passage_context=None, max_snippets=3):
@@ -512,9 +570,7 @@ def build_reference_context(user_input, passage_context=None, max_snippets=3):
 
     formatted_snippets = []
     for snippet in snippets:
-        text = snippet["text"].strip()
-        if len(text) > 600:
-            text = text[:600].rsplit(" ", 1)[0] + "..."
+        text = snippet["text"].strip() if CORPUS_CONTEXT_WORDS else knowledge_base.trim_excerpt(snippet["text"])
         formatted = f"Source: {snippet['source']}\nExcerpt: {text}"
         formatted_snippets.append(formatted)
 
@@ -0,0 +1,579 @@
+"""Offline benchmarks for the corpus retrieval helpers in knowledge_base.py.
+
+Runs against the built index when one exists, or against synthetic clustered
+vectors (``--synthetic N``) so numbers can be produced without an API key.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import platform
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import ann_index
+import embedding_providers
+import knowledge_base
+
+
+SYNTHETIC_BLOCK_ROWS = 65536
+
+
+def synthetic_embeddings(count: int, dim: int, seed: int = 0, clusters: int = 64) -> np.ndarray:
+    """Clustered unit vectors, closer to real embedding geometry than pure noise.
+
+    Generated block by block so a 1M-row matrix needs no full-size temporaries.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    vectors = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, SYNTHETIC_BLOCK_ROWS):
+        rows = min(SYNTHETIC_BLOCK_ROWS, count - start)
+        block = centers[rng.integers(0, clusters, size=rows)]
+        block += 0.6 * rng.standard_normal((rows, dim), dtype=np.float32)
+        vectors[start : start + rows] = knowledge_base._normalize_rows(block)
+    return vectors
+
+
+def sample_queries(embeddings: np.ndarray, count: int, seed: int = 1) -> np.ndarray:
+    """Perturbed corpus rows stand in for real query embeddings."""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, embeddings.shape[0], size=count)
+    noise = 0.5 * rng.standard_normal((count, embeddings.shape[1]), dtype=np.float32)
+    base = np.asarray(embeddings[rows], dtype=np.float32)
+    return knowledge_base._normalize_rows(base + noise * np.abs(base).mean())
+
+
+def recall_at_k(expected: np.ndarray, found: np.ndarray) -> float:
+    return len(set(expected.tolist()) & set(found.tolist())) / max(1, len(expected))
+
+
+def load_exact_matrix(synthetic: int, dim: int) -> np.ndarray:
+    if synthetic:
+        return synthetic_embeddings(synthetic, dim)
+    data = knowledge_base._load_index()
+    if knowledge_base.index_dimensions() == 0:
+        raise SystemExit("No corpus index found. Build one or pass --synthetic N.")
+    return knowledge_base._row_vectors(data, np.arange(len(data["chunks"])))
+
+
+def bench_quantization(args: argparse.Namespace) -> Dict[str, object]:
+    exact = load_exact_matrix(args.synthetic, args.dim)
+    queries = sample_queries(exact, args.queries)
+    exact_data = {"embeddings": exact, "storage": "float32"}
+    expected = [knowledge_base._search_index(exact_data, q[None, :], args.top_k)[0][0] for q in queries]
+    baseline_bytes = exact.nbytes
+
+    report: Dict[str, object] = {"rows": int(exact.shape[0]), "dim": int(exact.shape[1]), "top_k": args.top_k}
+    modes: List[Dict[str, object]] = []
+    for storage in knowledge_base.STORAGE_MODES:
+        data = {**knowledge_base.quantize_rows(exact, storage), "storage": storage}
+        if storage != "float32":
+            data["exact"] = exact
+        scan_bytes = sum(data[key].nbytes for key in ("embeddings", "scales") if key in data)
+
+        entry: Dict[str, object] = {
+            "storage": storage,
+            "scan_bytes": int(scan_bytes),
+            "memory_saved_pct": round(100.0 * (1 - scan_bytes / baseline_bytes), 1),
+        }
+        for label, factor in (("first_pass", 0), ("rescored", args.rescore_factor)):
+            start = time.perf_counter()
+            found = [knowledge_base._search_index(data, q[None, :], args.top_k, factor)[0][0] for q in queries]
+            elapsed = time.perf_counter() - start
+            entry[f"recall_{label}"] = round(float(np.mean([recall_at_k(e, f) for e, f in zip(expected, found)])), 4)
+            entry[f"ms_per_query_{label}"] = round(1000 * elapsed / len(queries), 3)
+        modes.append(entry)
+
+    report["modes"] = modes
+    return report
+
+
+def _latency_ms(samples: List[float]) -> Dict[str, float]:
+    millis = 1000 * np.asarray(samples)
+    return {"p50_ms": round(float(np.percentile(millis, 50)), 3), "p99_ms": round(float(np.percentile(millis, 99)), 3)}
+
+
+def bench_ann(args: argparse.Namespace) -> Dict[str, object]:
+    """IVF latency and recall@k against the exact scan at several corpus sizes."""
+    report: Dict[str, object] = {"dim": args.dim, "top_k": args.top_k, "sizes": []}
+    for size in args.sizes:
+        vectors = synthetic_embeddings(size, args.dim)
+        queries = sample_queries(vectors, args.queries)
+        data: Dict[str, object] = {"embeddings": vectors, "storage": "float32"}
+
+        exact_times, expected = [], []
+        for q in queries:
+            start = time.perf_counter()
+            expected.append(knowledge_base._search_index(data, q[None, :], args.top_k)[0][0])
+            exact_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        data["ivf"] = ann_index.build_ivf(vectors, args.lists)
+        build_seconds = time.perf_counter() - start
+
+        entry: Dict[str, object] = {
+            "rows": size,
+            "lists": int(data["ivf"]["centroids"].shape[0]),
+            "ivf_build_s": round(build_seconds, 2),
+            "exact": _latency_ms(exact_times),
+            "ivf": [],
+        }
+        for nprobe in args.nprobe:
+            times, recalls = [], []
+            for q, truth in zip(queries, expected):
+                start = time.perf_counter()
+                found = knowledge_base._search_index(data, q[None, :], args.top_k, nprobe=nprobe)[0][0]
+                times.append(time.perf_counter() - start)
+                recalls.append(recall_at_k(truth, found[found >= 0]))
+            entry["ivf"].append({"nprobe": nprobe, **_latency_ms(times), "recall": round(float(np.mean(recalls)), 4)})
+        report["sizes"].append(entry)
+        print(json.dumps(entry), flush=True)
+        del vectors, data
+    return report
+
+
+def bench_dimensions(args: argparse.Namespace) -> Dict[str, object]:
+    """Recall@k and latency of Matryoshka-truncated widths against the full-width exact scan.
+
+    Synthetic vectors have no Matryoshka structure, so their recall is a lower bound;
+    run against a real text-embedding-3 index for meaningful numbers.
+    """
+    exact = load_exact_matrix(args.synthetic, args.dim)
+    queries = sample_queries(exact, args.queries)
+    full_data = {"embeddings": exact, "storage": "float32"}
+    expected = [knowledge_base._search_index(full_data, q[None, :], args.top_k)[0][0] for q in queries]
+
+    report: Dict[str, object] = {"rows": int(exact.shape[0]), "dim": int(exact.shape[1]), "top_k": args.top_k, "widths": []}
+    for width in args.widths:
+        if width > exact.shape[1]:
+            continue
+        data = {"embeddings": knowledge_base.truncate_rows(exact, width), "storage": "float32"}
+        truncated_queries = knowledge_base.truncate_rows(queries, width)
+        times, recalls = [], []
+        for q, truth in zip(truncated_queries, expected):
+            start = time.perf_counter()
+            found = knowledge_base._search_index(data, q[None, :], args.top_k)[0][0]
+            times.append(time.perf_counter() - start)
+            recalls.append(recall_at_k(truth, found))
+        report["widths"].append(
+            {
+                "dimensions": width,
+                "index_bytes": int(data["embeddings"].nbytes),
+                **_latency_ms(times),
+                "recall": round(float(np.mean(recalls)), 4),
+            }
+        )
+    return report
+
+
+def synthetic_chunks(count: int, words: int = 150, seed: int = 0) -> List[Dict[str, str]]:
+    """Chunk metadata with prose-sized texts, so sidecar memory is realistic."""
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"word{i}" for i in range(5000)])
+    return [
+        {"id": f"synthetic_{i}", "source": f"data/synthetic/doc_{i // 40}.txt", "text": " ".join(vocabulary[rng.integers(0, 5000, size=words)])}
+        for i in range(count)
+    ]
+
+
+def process_memory_mb() -> Dict[str, float]:
+    """RSS, PSS (shared pages split between their users) and private memory of this process. Linux only."""
+    fields: Dict[str, int] = {}
+    with open("/proc/self/smaps_rollup", encoding="utf-8") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                fields[name] = int(rest.split()[0])
+    return {
+        "rss_mb": round(fields["Rss"] / 1024, 1),
+        "pss_mb": round(fields["Pss"] / 1024, 1),
+        "private_mb": round((fields["Private_Clean"] + fields["Private_Dirty"]) / 1024, 1),
+    }
+
+
+def _memory_worker(queries: np.ndarray, barrier, results) -> None:
+    """One simulated web worker: serve a few searches, then measure while every sibling is alive."""
+    knowledge_base.search_by_embeddings(queries, top_k=10)
+    knowledge_base.search_lexical("word1 word2 word3", top_k=10)
+    barrier.wait()
+    results.put(process_memory_mb())
+    barrier.wait()
+
+
+def _measure_workers(workers: int, queries: np.ndarray) -> Dict[str, object]:
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=_memory_worker, args=(queries, barrier, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    per_worker = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return {
+        "workers": per_worker,
+        "total_rss_mb": round(sum(w["rss_mb"] for w in per_worker), 1),
+        "total_pss_mb": round(sum(w["pss_mb"] for w in per_worker), 1),
+        "total_private_mb": round(sum(w["private_mb"] for w in per_worker), 1),
+    }
+
+
+def bench_memory(args: argparse.Namespace) -> Dict[str, object]:
+    """Per-worker memory with each worker loading its own index vs. one index preloaded before fork.
+
+    RSS counts shared pages in every worker that touches them; PSS splits them between
+    the workers, so total PSS is what the host actually pays.
+    """
+    with tempfile.TemporaryDirectory() as scratch:
+        if args.synthetic:
+            vectors = synthetic_embeddings(args.synthetic, args.dim)
+            knowledge_base.write_binary_index(
+                Path(scratch), "synthetic", vectors, synthetic_chunks(args.synthetic), storage=args.storage
+            )
+            knowledge_base.BINARY_INDEX_DIR = Path(scratch)
+            knowledge_base.INDEX_PATH = Path(scratch) / "missing.jsonl"
+            del vectors
+        knowledge_base.LOAD_DIMENSIONS = args.load_dimensions or knowledge_base.LOAD_DIMENSIONS
+        knowledge_base.clear_cache()
+        if not knowledge_base.index_available():
+            raise SystemExit("No corpus index found. Build one or pass --synthetic N.")
+
+        header = knowledge_base._read_index()
+        queries = sample_queries(knowledge_base._row_vectors(header, np.arange(min(1000, len(header["chunks"])))), 20)
+        del header
+
+        report: Dict[str, object] = {"workers": args.workers, "master_before_mb": process_memory_mb()}
+        knowledge_base.clear_cache()
+        report["per_worker_load"] = _measure_workers(args.workers, queries)
+        knowledge_base.preload_index()
+        report["master_preloaded_mb"] = process_memory_mb()
+        report["preloaded_before_fork"] = _measure_workers(args.workers, queries)
+        knowledge_base.clear_cache()
+    return report
+
+
+SCALING_FORMATS = ("jsonl", "float32", "float16", "int8", "ivf")
+
+
+def write_jsonl_index(path: Path, vectors: np.ndarray, chunks: List[Dict[str, str]], model: str) -> None:
+    """The legacy one-record-per-line layout build_corpus_index.py writes."""
+    with path.open("w", encoding="utf-8") as f:
+        for chunk, vector in zip(chunks, vectors):
+            record = {**chunk, "embedding": [round(float(x), 6) for x in vector], "model": model}
+            f.write(json.dumps(record) + "\n")
+
+
+def _write_scaling_index(scratch: Path, fmt: str, vectors: np.ndarray, chunks: List[Dict[str, str]]) -> Path:
+    if fmt == "jsonl":
+        path = scratch / "corpus_index.jsonl"
+        write_jsonl_index(path, vectors, chunks, "synthetic")
+        return path
+    out_dir = scratch / f"corpus_index_{fmt}"
+    storage = "float32" if fmt == "ivf" else fmt
+    knowledge_base.write_binary_index(out_dir, "synthetic", vectors, chunks, storage=storage, ann=fmt == "ivf")
+    return out_dir
+
+
+def _peak_rss_mb() -> float:
+    """High-water RSS of this process (VmHWM; unlike ru_maxrss it is not inherited across exec). Linux only."""
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return 0.0
+
+
+def _scaling_child(fmt: str, path: str, queries: np.ndarray, expected: Dict[int, np.ndarray], results) -> None:
+    """Runs in a fresh interpreter so load time and peak RSS belong to this format alone."""
+    if fmt == "jsonl":
+        knowledge_base.INDEX_PATH = Path(path)
+        knowledge_base.BINARY_INDEX_DIR = Path(path).parent / "no_binary_index"
+    else:
+        knowledge_base.BINARY_INDEX_DIR = Path(path)
+    baseline_rss = _peak_rss_mb()
+    start = time.perf_counter()
+    data = knowledge_base._load_index()
+    entry: Dict[str, object] = {
+        "load_s": round(time.perf_counter() - start, 3),
+        "baseline_rss_mb": baseline_rss,
+        "search": {},
+    }
+    for top_k, truth in expected.items():
+        knowledge_base.search_by_embedding(queries[0].tolist(), top_k=top_k)  # warm the page cache
+        times = []
+        for q in queries:
+            start = time.perf_counter()
+            knowledge_base.search_by_embedding(q.tolist(), top_k=top_k)
+            times.append(time.perf_counter() - start)
+        found, _ = knowledge_base._search_index(data, queries, top_k)
+        recall = np.mean([recall_at_k(t, f[f >= 0]) for t, f in zip(truth, found)])
+        entry["search"][str(top_k)] = {**_latency_ms(times), "recall": round(float(recall), 4)}
+    entry["peak_rss_mb"] = _peak_rss_mb()
+    results.put(entry)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def bench_scaling(args: argparse.Namespace) -> Dict[str, object]:
+    """Load time, peak RSS, latency and recall for every index format at several corpus sizes.
+
+    Each format is loaded and searched in a spawned interpreter. Recall is measured
+    against the exact float32 scan, so it is 1.0 for exact formats and shows the
+    loss of the quantized first pass (after rescoring) and of the IVF probe.
+    """
+    report: Dict[str, object] = {
+        "commit": _git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "dim": args.dim,
+        "queries": args.queries,
+        "top_k": args.top_k,
+        "sizes": {},
+    }
+    context = multiprocessing.get_context("spawn")
+    for size in args.sizes:
+        vectors = synthetic_embeddings(size, args.dim)
+        chunks = synthetic_chunks(size, words=args.words)
+        queries = sample_queries(vectors, args.queries)
+        exact_data = {"embeddings": vectors, "storage": "float32"}
+        expected = {k: knowledge_base._search_index(exact_data, queries, k)[0] for k in args.top_k}
+
+        entries: Dict[str, object] = {}
+        for fmt in args.formats:
+            if fmt == "jsonl" and size > args.jsonl_max_rows:
+                entries[fmt] = {"skipped": f"more than --jsonl-max-rows {args.jsonl_max_rows}"}
+                continue
+            with tempfile.TemporaryDirectory() as scratch:
+                start = time.perf_counter()
+                path = _write_scaling_index(Path(scratch), fmt, vectors, chunks)
+                write_seconds = time.perf_counter() - start
+                results = context.Queue()
+                child = context.Process(target=_scaling_child, args=(fmt, str(path), queries, expected, results))
+                child.start()
+                entry = results.get()
+                child.join()
+            entries[fmt] = {"write_s": round(write_seconds, 2), **entry}
+            print(json.dumps({"rows": size, "format": fmt, **entries[fmt]}), flush=True)
+        report["sizes"][str(size)] = entries
+        del vectors, chunks, exact_data
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return report
+
+
+SHINGLE_WORDS = 8
+
+
+def redundant_words(snippets: List[str]) -> Tuple[int, int]:
+    """(total words, words already covered by an 8-word shingle of an earlier snippet)."""
+    seen = set()
+    total = redundant = 0
+    for text in snippets:
+        words = text.split()
+        covered = np.zeros(len(words), dtype=bool)
+        shingles = [tuple(words[i : i + SHINGLE_WORDS]) for i in range(max(0, len(words) - SHINGLE_WORDS + 1))]
+        for i, shingle in enumerate(shingles):
+            if shingle in seen:
+                covered[i : i + SHINGLE_WORDS] = True
+        seen.update(shingles)
+        total += len(words)
+        redundant += int(covered.sum())
+    return total, redundant
+
+
+def bench_diversity(args: argparse.Namespace) -> Dict[str, object]:
+    """Redundant prompt tokens in reference context with and without MMR / per-source caps.
+
+    Corpus rows stand in for queries (the guide's queries embed the passage of focus),
+    and snippets are trimmed with the guide's ``knowledge_base.trim_excerpt``.
+    """
+    data = knowledge_base._load_index()
+    if knowledge_base.index_dimensions() == 0:
+        raise SystemExit("No corpus index found. Build one first.")
+    rows = np.random.default_rng(0).choice(len(data["chunks"]), size=min(args.queries, len(data["chunks"])), replace=False)
+    queries = knowledge_base._row_vectors(data, np.sort(rows))
+
+    configs = {
+        "baseline": {},
+        f"mmr_{args.mmr_lambda}": {"mmr_lambda": args.mmr_lambda},
+        f"max_per_source_{args.max_per_source}": {"max_per_source": args.max_per_source},
+        "mmr_and_cap": {"mmr_lambda": args.mmr_lambda, "max_per_source": args.max_per_source},
+    }
+    report: Dict[str, object] = {"queries": len(queries), "top_k": args.top_k, "configs": {}}
+    baseline_redundant = None
+    for name, options in configs.items():
+        start = time.perf_counter()
+        batch = knowledge_base.search_by_embeddings(queries, top_k=args.top_k, **options)
+        elapsed = time.perf_counter() - start
+        totals = [redundant_words([knowledge_base.trim_excerpt(hit["text"]) for hit in hits]) for hits in batch]
+        redundant = float(np.mean([r for _, r in totals])) * embedding_providers.TOKENS_PER_WORD
+        baseline_redundant = redundant if baseline_redundant is None else baseline_redundant
+        report["configs"][name] = {
+            "context_tokens_per_request": round(float(np.mean([t for t, _ in totals])) * embedding_providers.TOKENS_PER_WORD, 1),
+            "redundant_tokens_per_request": round(redundant, 1),
+            "tokens_saved_per_request": round(baseline_redundant - redundant, 1),
+            "distinct_sources_per_request": round(float(np.mean([len({hit["source"] for hit in hits}) for hits in batch])), 2),
+            "ms_per_query": round(1000 * elapsed / len(queries), 3),
+        }
+    return report
+
+
+async def _stall_run(queries: np.ndarray, mode: str, concurrency: int, top_k: int, tick: float) -> Dict[str, object]:
+    """Heartbeat lateness on the event loop while ``concurrency`` tasks search back to back."""
+    lateness: List[float] = []
+    done = asyncio.Event()
+
+    async def heartbeat() -> None:
+        # Stands in for audio frame handling: wakes every ``tick`` seconds and records how late it was
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(tick)
+            lateness.append(max(0.0, time.perf_counter() - start - tick))
+
+    async def searcher(rows: np.ndarray) -> None:
+        for query in rows:
+            if mode == "sync":
+                knowledge_base.search_by_embedding(query, top_k=top_k)
+                await asyncio.sleep(0)
+            else:
+                await knowledge_base.asearch(query, top_k=top_k)
+
+    beat = asyncio.create_task(heartbeat())
+    start = time.perf_counter()
+    await asyncio.gather(*(searcher(queries[i::concurrency]) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await beat
+    return {
+        "searches_per_sec": round(len(queries) / elapsed, 1),
+        "max_stall_ms": round(1000 * max(lateness, default=0.0), 3),
+        **{key.replace("_ms", "_stall_ms"): value for key, value in _latency_ms(lateness or [0.0]).items()},
+    }
+
+
+def bench_stall(args: argparse.Namespace) -> Dict[str, object]:
+    """Worst-case event-loop stall of blocking search calls vs. the asearch coroutines."""
+    with tempfile.TemporaryDirectory() as scratch:
+        if args.synthetic:
+            vectors = synthetic_embeddings(args.synthetic, args.dim)
+            knowledge_base.write_binary_index(Path(scratch), "synthetic", vectors, synthetic_chunks(args.synthetic))
+            knowledge_base.BINARY_INDEX_DIR = Path(scratch)
+            knowledge_base.INDEX_PATH = Path(scratch) / "missing.jsonl"
+            del vectors
+        knowledge_base.clear_cache()
+        exact = load_exact_matrix(0, args.dim)
+        queries = sample_queries(exact, args.queries)
+        del exact
+        knowledge_base.search_by_embedding(queries[0], top_k=args.top_k)  # warm the index outside the timings
+
+        report: Dict[str, object] = {
+            "rows": len(knowledge_base._load_index()["chunks"]),
+            "tick_ms": args.tick_ms,
+            "concurrency": args.concurrency,
+            "async_threads": knowledge_base.ASYNC_SEARCH_THREADS,
+        }
+        for mode in ("sync", "async"):
+            report[mode] = asyncio.run(_stall_run(queries, mode, args.concurrency, args.top_k, args.tick_ms / 1000))
+        return report
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark Vonnegut corpus retrieval")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    quant = subparsers.add_parser("quantization", help="Memory and recall@k of float16/int8 storage vs exact float32")
+    quant.add_argument("--synthetic", type=int, default=0, help="Use N synthetic vectors instead of the built index")
+    quant.add_argument("--dim", type=int, default=3072, help="Synthetic vector width (default: %(default)s)")
+    quant.add_argument("--queries", type=int, default=200, help="Number of sampled queries (default: %(default)s)")
+    quant.add_argument("--top-k", type=int, default=10, help="k for recall@k (default: %(default)s)")
+    quant.add_argument(
+        "--rescore-factor",
+        type=int,
+        default=knowledge_base.DEFAULT_RESCORE_FACTOR,
+        help="Shortlist size as a multiple of top-k (default: %(default)s)",
+    )
+    quant.set_defaults(handler=bench_quantization)
+
+    ann = subparsers.add_parser("ann", help="IVF latency and recall@k vs exact search on synthetic corpora")
+    ann.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    ann.add_argument("--dim", type=int, default=256, help="Synthetic vector width (default: %(default)s)")
+    ann.add_argument("--queries", type=int, default=100, help="Number of sampled queries (default: %(default)s)")
+    ann.add_argument("--top-k", type=int, default=10, help="k for recall@k (default: %(default)s)")
+    ann.add_argument("--lists", type=int, default=None, help="IVF list count (default: about sqrt(rows))")
+    ann.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    ann.set_defaults(handler=bench_ann)
+
+    dims = subparsers.add_parser("dimensions", help="Recall@k and latency of truncated embedding widths")
+    dims.add_argument("--synthetic", type=int, default=0, help="Use N synthetic vectors instead of the built index")
+    dims.add_argument("--dim", type=int, default=3072, help="Synthetic vector width (default: %(default)s)")
+    dims.add_argument("--widths", type=int, nargs="+", default=[256, 512, 1024, 1536, 3072])
+    dims.add_argument("--queries", type=int, default=200, help="Number of sampled queries (default: %(default)s)")
+    dims.add_argument("--top-k", type=int, default=10, help="k for recall@k (default: %(default)s)")
+    dims.set_defaults(handler=bench_dimensions)
+
+    scaling = subparsers.add_parser("scaling", help="Load time, peak RSS, latency and recall per index format and corpus size")
+    scaling.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    scaling.add_argument("--formats", nargs="+", choices=SCALING_FORMATS, default=list(SCALING_FORMATS))
+    scaling.add_argument("--dim", type=int, default=256, help="Synthetic vector width (default: %(default)s)")
+    scaling.add_argument("--words", type=int, default=40, help="Words per synthetic chunk (default: %(default)s)")
+    scaling.add_argument("--queries", type=int, default=100, help="Number of sampled queries (default: %(default)s)")
+    scaling.add_argument("--top-k", type=int, nargs="+", default=[3, 10, 50])
+    scaling.add_argument(
+        "--jsonl-max-rows",
+        type=int,
+        default=100_000,
+        help="Skip the JSONL format above this size; parsing it needs ~30 bytes per float (default: %(default)s)",
+    )
+    scaling.add_argument("--output", default=None, help="Also write the report to this JSON file")
+    scaling.set_defaults(handler=bench_scaling)
+
+    memory = subparsers.add_parser("memory", help="Per-worker RSS/PSS with and without preloading the index before fork")
+    memory.add_argument("--workers", type=int, default=4, help="Simulated gunicorn workers (default: %(default)s)")
+    memory.add_argument("--synthetic", type=int, default=0, help="Write and use N synthetic chunks instead of the built index")
+    memory.add_argument("--dim", type=int, default=3072, help="Synthetic vector width (default: %(default)s)")
+    memory.add_argument("--storage", choices=knowledge_base.STORAGE_MODES, default="float32")
+    memory.add_argument("--load-dimensions", type=int, default=0, help="Truncate at load time, as CORPUS_INDEX_DIMENSIONS does")
+    memory.set_defaults(handler=bench_memory)
+
+    diversity = subparsers.add_parser("diversity", help="Redundant reference-context tokens saved by MMR / per-source caps")
+    diversity.add_argument("--queries", type=int, default=200, help="Number of sampled queries (default: %(default)s)")
+    diversity.add_argument("--top-k", type=int, default=3, help="Snippets per request (default: %(default)s)")
+    diversity.add_argument("--mmr-lambda", type=float, default=0.5, help="MMR relevance weight (default: %(default)s)")
+    diversity.add_argument("--max-per-source", type=int, default=2, help="Per-document cap (default: %(default)s)")
+    diversity.set_defaults(handler=bench_diversity)
+
+    stall = subparsers.add_parser("stall", help="Event-loop stall of blocking search vs. knowledge_base.asearch")
+    stall.add_argument("--synthetic", type=int, default=0, help="Write and use N synthetic chunks instead of the built index")
+    stall.add_argument("--dim", type=int, default=256, help="Synthetic vector width (default: %(default)s)")
+    stall.add_argument("--queries", type=int, default=100, help="Searches per mode (default: %(default)s)")
+    stall.add_argument("--concurrency", type=int, default=2, help="Concurrent searching tasks (default: %(default)s)")
+    stall.add_argument("--top-k", type=int, default=3, help="Results per search (default: %(default)s)")
+    stall.add_argument("--tick-ms", type=float, default=10.0, help="Heartbeat period, e.g. one audio frame (default: %(default)s)")
+    stall.set_defaults(handler=bench_stall)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    report = args.handler(args)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
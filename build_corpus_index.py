@@ -3,23 +3,53 @@
 from __future__ import annotations
 
 import argparse
+import bisect
+import hashlib
+import itertools
 import json
 import math
 import os
+import re
+import shutil
+import time
+from collections import deque
+from collections.abc import Sequence as SequenceABC
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Iterable, List, Sequence
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-import openai
+import numpy as np
 from dotenv import load_dotenv
 
+import embedding_cache
+import embedding_providers
+import knowledge_base
+import near_duplicates
+import text_extractors
+
 load_dotenv()
 
 # Config defaults
 DEFAULT_MODEL = "text-embedding-3-large"
 DEFAULT_CHUNK_SIZE = 280  # words
 DEFAULT_CHUNK_OVERLAP = 60  # words
-INDEX_PATH = Path("data/corpus_index.jsonl")
+INDEX_PATH = knowledge_base.INDEX_PATH
+BINARY_INDEX_DIR = knowledge_base.BINARY_INDEX_DIR
 MANIFEST_PATH = Path("data/corpus_manifest.json")
+# Staging for an in-progress build: the embedding spool and its checkpoint survive a
+# crash so --resume skips the batches already paid for
+BUILD_DIR = Path("data/.corpus_build")
+SPOOL_PATH = BUILD_DIR / "embedded.npy"
+CHECKPOINT_PATH = BUILD_DIR / "checkpoint.json"
+MATRIX_PATH = BUILD_DIR / "matrix.npy"
+# Chunk records of the build, so texts stay on disk until each stage reads them
+RECORDS_PATH = BUILD_DIR / "records.jsonl"
+ASSEMBLE_BLOCK_ROWS = 4096
+# Files in flight per ingest worker; bounds memory while keeping the pool busy
+INGEST_WINDOW_PER_WORKER = 4
+INGEST_STAGES = ("read", "chunk", "hash")
+# Words as normalize_text + str.split see them (\s is str.isspace)
+WORD_PATTERN = re.compile(r"\S+")
 
 # Directories to scan by default
 DEFAULT_SOURCE_DIRS = [
@@ -29,16 +59,22 @@ DEFAULT_SOURCE_DIRS = [
 ]
 
 
+def is_source_file(path: Path) -> bool:
+    """Plain text, or a format with a registered extractor (PDF, HTML, EPUB)."""
+    suffix = path.suffix.lower()
+    return suffix == ".txt" or suffix in text_extractors.EXTRACTORS
+
+
 def iter_text_files(paths: Sequence[Path]) -> Iterable[Path]:
-    """Yield .txt files from provided directories."""
+    """Yield .txt files and other extractable documents from provided directories."""
     for base in paths:
         if not base.exists():
             continue
-        if base.is_file() and base.suffix.lower() == ".txt":
+        if base.is_file() and is_source_file(base):
             yield base
             continue
-        for path in base.rglob("*.txt"):
-            if path.name.startswith("."):
+        for path in base.rglob("*"):
+            if path.name.startswith(".") or not is_source_file(path) or not path.is_file():
                 continue
             yield path
 
@@ -71,9 +107,533 @@ def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
     return chunks
 
 
-def batched(seq: Sequence[str], batch_size: int) -> Iterable[List[str]]:
-    for i in range(0, len(seq), batch_size):
-        yield list(seq[i : i + batch_size])
+def iter_words(pieces: Iterable[str]) -> Iterator[Tuple[str, int, int]]:
+    """(word, start, end) for each word ``normalize_text`` keeps, offsets into the joined pieces.
+
+    The words are exactly ``normalize_text("".join(pieces)).split()``; the offsets
+    index the source text as read, so chunks can cite exact character spans.
+    """
+    offset = 0
+    for piece in pieces:
+        for line in piece.splitlines(keepends=True):
+            # Placeholder/instructional comments are dropped, as in normalize_text
+            if not line.strip().startswith("#"):
+                for match in WORD_PATTERN.finditer(line):
+                    yield match.group(), offset + match.start(), offset + match.end()
+            offset += len(line)
+
+
+def iter_chunks(
+    words: Iterable[Tuple[str, int, int]],
+    chunk_size: int,
+    overlap: int,
+) -> Iterator[List[Tuple[str, int, int]]]:
+    """The word runs of ``chunk_text``, from a word stream (e.g. PDF pages) with bounded memory.
+
+    Only the words of the chunk being filled are buffered, never the whole document.
+    """
+    step = max(1, chunk_size - overlap)
+    window: List[Tuple[str, int, int]] = []
+    # Leading buffered words already emitted in the previous chunk
+    covered = 0
+    for word in words:
+        window.append(word)
+        if len(window) >= chunk_size:
+            yield window[:chunk_size]
+            window = window[step:]
+            covered = min(len(window), chunk_size - step)
+    if len(window) > covered:
+        yield window
+
+
+def chunk_spans(run: Sequence[Tuple[str, int, int]], max_input_tokens: Optional[int]) -> List[Tuple[str, int, int]]:
+    """(text, start, end) for a chunk's word run, split where it exceeds the model's input limit."""
+    text = " ".join(word for word, _, _ in run)
+    pieces = embedding_providers.split_to_limit(text, max_input_tokens)
+    if len(pieces) == 1:
+        return [(text, run[0][1], run[-1][2])]
+    # Pieces are consecutive substrings of ``text``; map their positions back to the source
+    starts = list(itertools.accumulate((len(word) + 1 for word, _, _ in run[:-1]), initial=0))
+
+    def source_offset(position: int) -> int:
+        word = bisect.bisect_right(starts, position) - 1
+        return run[word][1] + position - starts[word]
+
+    spans = []
+    cursor = 0
+    for piece in pieces:
+        found = text.find(piece, cursor)
+        cursor = found + len(piece)
+        spans.append((piece, source_offset(found), source_offset(cursor - 1) + 1))
+    return spans
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def read_manifest() -> Dict[str, object]:
+    if not MANIFEST_PATH.exists():
+        return {}
+    try:
+        return json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def same_vector_space(manifest: Dict[str, object], settings: Dict[str, object]) -> bool:
+    """Whether the manifest's index was embedded with the same provider, model and width."""
+    build = manifest.get("build")
+    if build is None:
+        # Manifests from before build settings were recorded: trust what they do say
+        build = {"provider": manifest.get("provider", "openai"), "model": manifest.get("model"), "dimensions": settings["dimensions"]}
+    return all(build.get(key) == settings[key] for key in ("provider", "model", "dimensions"))
+
+
+def previous_index_rows(
+    manifest: Dict[str, object],
+    settings: Dict[str, object],
+) -> Tuple[Dict[str, int], Optional[Dict[str, np.ndarray]]]:
+    """Rows of the currently published index keyed by chunk hash, plus the loaded index.
+
+    Empty when the index was embedded differently (provider, model or width), so
+    nothing from an incompatible vector space is ever reused. Vectors stay in the
+    memory-mapped index until assembly copies them out block by block.
+    """
+    if not same_vector_space(manifest, settings):
+        return {}, None
+    # CORPUS_INDEX_DIMENSIONS would hand back truncated vectors
+    if knowledge_base.LOAD_DIMENSIONS or not knowledge_base.index_available():
+        return {}, None
+    data = knowledge_base._read_index()
+    expected = manifest.get("dimensions") or settings["dimensions"]
+    if expected and knowledge_base._index_width(data) != expected:
+        return {}, None
+    return {content_hash(chunk["text"]): row for row, chunk in enumerate(data["chunks"])}, data
+
+
+def _timed(pieces: Iterable[str], stats: Dict[str, float], key: str) -> Iterator[str]:
+    """Pass ``pieces`` through, adding the time spent producing them to ``stats[key]``."""
+    iterator = iter(pieces)
+    while True:
+        started = time.perf_counter()
+        piece = next(iterator, None)
+        stats[key] += time.perf_counter() - started
+        if piece is None:
+            return
+        yield piece
+
+
+def chunk_source_file(
+    filepath: Path,
+    chunk_size: int,
+    overlap: int,
+    max_input_tokens: Optional[int],
+) -> Tuple[Path, str, str, List[str], List[str], List[List[int]], Dict[str, float]]:
+    """Read, normalize and chunk one file.
+
+    Returns (path, source, file hash, chunks, chunk hashes, spans, stage stats). A span
+    is the chunk's [start, end) character range in the file's text as read (for
+    extracted formats, the cached extraction). Module-level so a process pool can run
+    it; stats hold bytes read and seconds per stage. Non-text formats stream through
+    their extractor a piece (page, chapter) at a time. Raises ExtractionError for a
+    file that cannot be extracted.
+    """
+    started = time.perf_counter()
+    timings = {"read": 0.0}
+    if filepath.suffix.lower() == ".txt":
+        raw_text = filepath.read_text(encoding="utf-8", errors="ignore")
+        file_hash = content_hash(raw_text)
+        timings["read"] = time.perf_counter() - started
+        pieces: Iterable[str] = [raw_text]
+    else:
+        file_hash = text_extractors.file_digest(filepath)
+        timings["read"] = time.perf_counter() - started
+        pieces = _timed(text_extractors.extracted_pieces(filepath, file_hash), timings, "read")
+    # A chunk over the model's per-input limit would be rejected; split it in place
+    spans = [item for run in iter_chunks(iter_words(pieces), chunk_size, overlap) for item in chunk_spans(run, max_input_tokens)]
+    chunk_done = time.perf_counter()
+    chunks = [text for text, _, _ in spans]
+    chunk_hashes = [content_hash(chunk) for chunk in chunks]
+    stats = {
+        "bytes": float(filepath.stat().st_size),
+        **timings,
+        "chunk": chunk_done - started - timings["read"],
+        "hash": time.perf_counter() - chunk_done,
+    }
+    return filepath, source_name(filepath), file_hash, chunks, chunk_hashes, [[start, end] for _, start, end in spans], stats
+
+
+def source_name(filepath: Path) -> str:
+    """The path a source is recorded under: relative to the working directory when inside it."""
+    try:
+        return str(filepath.relative_to(Path.cwd()))
+    except ValueError:
+        return str(filepath)
+
+
+def _chunk_job(filepath: Path, chunk_size: int, overlap: int, max_input_tokens: Optional[int]) -> Tuple:
+    """chunk_source_file, with an extraction failure returned as (path, reason) so a pool carries it back."""
+    try:
+        return chunk_source_file(filepath, chunk_size, overlap, max_input_tokens)
+    except text_extractors.ExtractionError as exc:
+        return filepath, str(exc)
+
+
+def iter_source_chunks(
+    source_dirs: Sequence[Path],
+    chunk_size: int,
+    overlap: int,
+    max_input_tokens: Optional[int],
+    workers: int = 1,
+    stats: Optional[Dict[str, float]] = None,
+    skipped: Optional[Dict[str, str]] = None,
+) -> Iterator[Tuple[Path, str, str, List[str], List[str], List[List[int]]]]:
+    """(path, source, file hash, chunks, chunk hashes, spans) per source file, in scan order.
+
+    With ``workers`` > 1 files are processed on a process pool; at most
+    ``INGEST_WINDOW_PER_WORKER * workers`` are in flight and results come back in
+    submission order, so output is identical to the sequential run. Per-stage
+    seconds and bytes are summed into ``stats``; files that cannot be extracted are
+    left out and recorded in ``skipped`` (source -> reason).
+    """
+    stats = {} if stats is None else stats
+    skipped = {} if skipped is None else skipped
+
+    def collect(result):
+        for key, value in result[-1].items():
+            stats[key] = stats.get(key, 0.0) + value
+        stats["files"] = stats.get("files", 0) + 1
+        stats["chunks"] = stats.get("chunks", 0) + len(result[3])
+        return result[:-1]
+
+    jobs = ((filepath, chunk_size, overlap, max_input_tokens) for filepath in iter_text_files(source_dirs))
+    if workers <= 1:
+        results = (_chunk_job(*job) for job in jobs)
+    else:
+        results = _pooled(jobs, workers)
+    for result in results:
+        if len(result) == 2:
+            # (path, reason): extraction failed
+            print(f"Skipping: {result[1]}")
+            skipped[source_name(result[0])] = result[1]
+        else:
+            yield collect(result)
+
+
+def _pooled(jobs: Iterable[Tuple], workers: int) -> Iterator:
+    """_chunk_job over ``jobs`` on a process pool, in submission order."""
+    window: deque = deque()
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for job in jobs:
+            window.append(pool.submit(_chunk_job, *job))
+            if len(window) >= INGEST_WINDOW_PER_WORKER * workers:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def report_ingest(stats: Dict[str, float], elapsed: float, workers: int) -> None:
+    """Print wall-clock ingest throughput and where worker time went."""
+    busy = sum(stats.get(stage, 0.0) for stage in INGEST_STAGES) or 1e-9
+    stages = ", ".join(
+        f"{stage} {stats.get(stage, 0.0):.2f}s ({stats.get('bytes', 0.0) / 1e6 / max(stats.get(stage, 0.0), 1e-9):.0f} MB/s)"
+        for stage in INGEST_STAGES
+    )
+    print(
+        f"Ingested {int(stats.get('files', 0))} files ({stats.get('bytes', 0.0) / 1e6:.1f} MB, "
+        f"{int(stats.get('chunks', 0))} chunks) in {elapsed:.2f}s with {workers} worker(s): "
+        f"{stats.get('files', 0) / max(elapsed, 1e-9):.0f} files/s, {stats.get('chunks', 0) / max(elapsed, 1e-9):.0f} chunks/s. "
+        f"Worker time {busy:.2f}s: {stages}."
+    )
+
+
+def report_skipped(skipped: Dict[str, str]) -> None:
+    if skipped:
+        print(f"⚠️ Not indexed: {len(skipped)} file(s) could not be extracted:")
+        for source in sorted(skipped):
+            # Extractor messages name the file
+            print(f"  {skipped[source]}")
+
+
+class RecordSpool(SequenceABC):
+    """Chunk records spooled to a JSONL file during a build, read back by position.
+
+    Only each record's byte offset (plus aliases added by deduplication) stays in
+    memory, so the corpus text is never held whole. ``subset`` and ``column`` are
+    views over the same file; ``column("text")`` is what the embedder reads.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        offsets: Optional[List[int]] = None,
+        aliases: Optional[Dict[int, List[str]]] = None,
+        field: Optional[str] = None,
+        handles: Optional[Dict[str, object]] = None,
+    ) -> None:
+        self.path = path
+        self.offsets = [] if offsets is None else offsets
+        # Keyed by byte offset, so every view of the spool sees them
+        self.aliases = {} if aliases is None else aliases
+        self.field = field
+        self.handles = {} if handles is None else handles
+
+    def append(self, record: Dict[str, object]) -> None:
+        writer = self.handles.get("writer")
+        if writer is None:
+            writer = self.handles["writer"] = self.path.open("wb")
+        self.offsets.append(writer.tell())
+        writer.write(json.dumps(record).encode("utf-8") + b"\n")
+
+    def close(self) -> None:
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
+
+    def subset(self, positions: Iterable[int]) -> "RecordSpool":
+        return RecordSpool(self.path, [self.offsets[pos] for pos in positions], self.aliases, self.field, self.handles)
+
+    def column(self, field: str) -> "RecordSpool":
+        return RecordSpool(self.path, self.offsets, self.aliases, field, self.handles)
+
+    def _finish_writing(self) -> None:
+        writer = self.handles.pop("writer", None)
+        if writer is not None:
+            writer.close()
+
+    def _decode(self, line: bytes, offset: int):
+        record = json.loads(line)
+        if offset in self.aliases:
+            record["aliases"] = self.aliases[offset]
+        return record[self.field] if self.field else record
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, position: int):
+        self._finish_writing()
+        reader = self.handles.get("reader")
+        if reader is None:
+            reader = self.handles["reader"] = self.path.open("rb")
+        offset = self.offsets[position]
+        reader.seek(offset)
+        return self._decode(reader.readline(), offset)
+
+    def __iter__(self):
+        self._finish_writing()
+        with self.path.open("rb") as f:
+            position = 0
+            for offset in self.offsets:
+                if offset != position:
+                    f.seek(offset)
+                line = f.readline()
+                position = offset + len(line)
+                yield self._decode(line, offset)
+
+
+def collapse_duplicates(records: RecordSpool, shards: Sequence[Optional[str]], threshold: float) -> List[int]:
+    """Keep one canonical record per near-duplicate group; the others' sources become its aliases.
+
+    Groups never span shards, so any shard can still be rebuilt on its own. All
+    groups shared by the same set of documents keep their canonical chunk in one
+    home document (most members, then most words, then first path), so two
+    overlapping texts never alternate and the home's ordinals stay adjacent. Within
+    the home the longest chunk wins. Aliases are recorded on the spool; returns the
+    positions of the records kept.
+    """
+    by_shard: Dict[Optional[str], List[int]] = {}
+    for pos, shard in enumerate(shards):
+        by_shard.setdefault(shard, []).append(pos)
+    groups: List[Dict[int, Tuple[str, int, int]]] = []
+    for positions in by_shard.values():
+        view = records.subset(positions)
+        for group in near_duplicates.duplicate_groups(view.column("text"), threshold):
+            members = {}
+            for member in group:
+                rec = view[member]
+                members[positions[member]] = (rec["source"], rec["ordinal"], len(rec["text"].split()))
+            groups.append(members)
+
+    # (members, words) per source, tallied over every group of the same document set
+    tallies: Dict[frozenset, Dict[str, List[int]]] = {}
+    for members in groups:
+        tally = tallies.setdefault(frozenset(source for source, _, _ in members.values()), {})
+        for source, _, words in members.values():
+            counts = tally.setdefault(source, [0, 0])
+            counts[0] += 1
+            counts[1] += words
+    dropped = set()
+    for members in groups:
+        sources = frozenset(source for source, _, _ in members.values())
+        tally = tallies[sources]
+        home = min(tally, key=lambda source: (-tally[source][0], -tally[source][1], source))
+        canonical = min(
+            (pos for pos, (source, _, _) in members.items() if source == home),
+            key=lambda pos: (-members[pos][2], members[pos][1]),
+        )
+        if len(sources) > 1:
+            records.aliases[records.offsets[canonical]] = sorted(sources - {home})
+        dropped.update(pos for pos in members if pos != canonical)
+    if dropped:
+        print(f"Collapsed {len(dropped)} near-duplicate chunks into their canonical copies.")
+    return [pos for pos in range(len(records)) if pos not in dropped]
+
+
+def read_checkpoint(plan: str) -> int:
+    """Spool rows committed by an interrupted build of the same plan (0 if none)."""
+    try:
+        checkpoint = json.loads(CHECKPOINT_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return 0
+    if checkpoint.get("plan") != plan or not SPOOL_PATH.exists():
+        return 0
+    return int(checkpoint.get("committed", 0))
+
+
+def prefetch_to_store(
+    provider,
+    texts: Iterable[Tuple[str, str]],
+    store: embedding_cache.EmbeddingStore,
+    store_key: Tuple[str, int],
+    batch_tokens: int,
+    batch_size: int,
+    parallelism: int,
+    limiter: Optional[embedding_providers.RateLimiter],
+) -> set:
+    """Embed (digest, text) pairs into the embedding store as ingestion produces them.
+
+    ``texts`` is a generator driven by ingestion, so requests are in flight while
+    later files are still being read, and ``embed_in_order`` keeps at most
+    ``2 * parallelism`` batches pending. The vectors land in the store, where the
+    spool fill picks them up, and an interrupted build keeps them. Returns the digests.
+    """
+    pending: deque = deque()
+    done = set()
+    stats: Dict[str, float] = {}
+    started = time.perf_counter()
+
+    def requests() -> Iterator[List[str]]:
+        weighted = ((pair, embedding_providers.count_tokens(pair[1])) for pair in texts)
+        for batch in embedding_providers.pack_stream(weighted, batch_tokens, batch_size):
+            pending.append([digest for digest, _ in batch])
+            yield [text for _, text in batch]
+
+    embedded = embedding_providers.embed_in_order(provider, requests(), parallelism=parallelism, limiter=limiter, stats=stats)
+    for vectors in embedded:
+        digests = pending.popleft()
+        store.put_many(*store_key, zip(digests, vectors))
+        done.update(digests)
+    if done:
+        elapsed = time.perf_counter() - started
+        print(
+            f"Embedded {len(done)} new chunks while ingesting in {elapsed:.1f}s "
+            f"({parallelism} parallel, {int(stats.get('retries', 0))} retries, "
+            f"{stats.get('throttled_seconds', 0.0):.1f}s rate-limited)."
+        )
+    return done
+
+
+def embed_to_spool(
+    provider,
+    texts: Sequence[str],
+    digests: Sequence[str],
+    plan: str,
+    resume: bool,
+    store: Optional[embedding_cache.EmbeddingStore],
+    store_key: Tuple[str, int],
+    batch_tokens: int,
+    batch_size: int,
+    parallelism: int,
+    limiter: Optional[embedding_providers.RateLimiter],
+) -> Tuple[Optional[np.ndarray], Dict[str, int]]:
+    """Fill SPOOL_PATH row i with the vector for ``texts[i]``, committing batch by batch.
+
+    Batches are contiguous and written in order; after each one the spool is flushed
+    and CHECKPOINT_PATH records how many rows are final, so ``resume`` restarts after
+    the last committed batch. Vectors the embedding store already holds are copied
+    instead of requested. Returns the spool (memory-mapped) and per-source counts.
+    """
+    counts = {"embedded": 0, "from_store": 0, "resumed": 0}
+    start = read_checkpoint(plan) if resume else 0
+    if not start:
+        SPOOL_PATH.unlink(missing_ok=True)
+        CHECKPOINT_PATH.unlink(missing_ok=True)
+    BUILD_DIR.mkdir(parents=True, exist_ok=True)
+    counts["resumed"] = start
+    spool = np.load(SPOOL_PATH, mmap_mode="r+") if start else None
+    if start:
+        print(f"Resuming: {start} of {len(texts)} vectors already committed.")
+    if start >= len(texts):
+        return spool, counts
+
+    in_store = store.present(*store_key, digests[start:]) if store is not None else set()
+    # Pack by token count: the fewest requests that stay under the per-request limits;
+    # stored vectors cost no tokens
+    weights = [0 if digests[i] in in_store else embedding_providers.count_tokens(texts[i]) for i in range(start, len(texts))]
+    batches = [[start + i for i in group] for group in embedding_providers.pack_batches(weights, batch_tokens, batch_size)]
+    stats: Dict[str, float] = {}
+    started = time.perf_counter()
+    embedded = embedding_providers.embed_in_order(
+        provider,
+        ([texts[i] for i in batch if digests[i] not in in_store] for batch in batches),
+        parallelism=parallelism,
+        limiter=limiter,
+        stats=stats,
+    )
+    for batch, vectors in zip(batches, embedded):
+        hits = store.get_many(*store_key, [digests[i] for i in batch if digests[i] in in_store]) if in_store else {}
+        misses = [i for i in batch if digests[i] not in hits]
+        missed_vectors = iter(vectors)
+        rows = np.stack([hits[digests[i]] if digests[i] in hits else next(missed_vectors) for i in batch])
+        if spool is None:
+            spool = np.lib.format.open_memmap(SPOOL_PATH, mode="w+", dtype=np.float32, shape=(len(texts), rows.shape[1]))
+        spool[batch[0] : batch[-1] + 1] = rows
+        spool.flush()
+        if store is not None and misses:
+            store.put_many(*store_key, ((digests[i], rows[i - batch[0]]) for i in misses))
+        # Checkpoint only after the rows are on disk, so it never claims unwritten work
+        knowledge_base.write_text_atomic(CHECKPOINT_PATH, json.dumps({"plan": plan, "committed": batch[-1] + 1}))
+        counts["embedded"] += len(misses)
+        counts["from_store"] += len(hits)
+
+    if counts["embedded"]:
+        elapsed = time.perf_counter() - started
+        tokens = sum(weights)
+        print(
+            f"Embedded {counts['embedded']} chunks ({tokens} tokens, {len(batches)} requests) in {elapsed:.1f}s "
+            f"({counts['embedded'] / elapsed:.1f} chunks/s, "
+            f"{parallelism} parallel, {int(stats.get('retries', 0))} retries, "
+            f"{stats.get('throttled_seconds', 0.0):.1f}s rate-limited)."
+        )
+    return spool, counts
+
+
+def assemble_matrix(
+    hashes: Sequence[str],
+    spool: Optional[np.ndarray],
+    spool_rows: Dict[str, int],
+    index: Optional[Dict[str, np.ndarray]],
+    index_rows: Dict[str, int],
+) -> np.ndarray:
+    """Write the row-per-record matrix to MATRIX_PATH block by block; returns it memory-mapped."""
+    width = spool.shape[1] if spool is not None else knowledge_base._index_width(index)
+    matrix = np.lib.format.open_memmap(MATRIX_PATH, mode="w+", dtype=np.float32, shape=(len(hashes), width))
+    for start in range(0, len(hashes), ASSEMBLE_BLOCK_ROWS):
+        block = hashes[start : start + ASSEMBLE_BLOCK_ROWS]
+        from_spool = [pos for pos, digest in enumerate(block) if digest in spool_rows]
+        from_index = [pos for pos, digest in enumerate(block) if digest not in spool_rows]
+        if from_spool:
+            matrix[[start + pos for pos in from_spool]] = spool[[spool_rows[block[pos]] for pos in from_spool]]
+        if from_index:
+            rows = np.array([index_rows[block[pos]] for pos in from_index], dtype=np.int64)
+            matrix[[start + pos for pos in from_index]] = knowledge_base._row_vectors(index, rows)
+    matrix.flush()
+    del matrix
+    return np.load(MATRIX_PATH, mmap_mode="r")
 
 
 def build_index(
@@ -82,60 +642,357 @@ def build_index(
     overlap: int,
     batch_size: int,
     source_dirs: Sequence[Path],
+    storage: str = "float32",
+    ann: bool = False,
+    ann_lists: Optional[int] = None,
+    dimensions: Optional[int] = None,
+    provider_name: str = "openai",
+    shard_by: Optional[str] = None,
+    only_shard: Optional[str] = None,
+    full: bool = False,
+    batch_tokens: int = embedding_providers.MAX_REQUEST_TOKENS,
+    embedding_store: Optional[Path] = embedding_cache.DEFAULT_STORE_PATH,
+    parallelism: int = embedding_providers.DEFAULT_PARALLELISM,
+    requests_per_minute: int = embedding_providers.DEFAULT_REQUESTS_PER_MINUTE,
+    tokens_per_minute: int = embedding_providers.DEFAULT_TOKENS_PER_MINUTE,
+    resume: bool = False,
+    dedupe_threshold: Optional[float] = near_duplicates.DEFAULT_THRESHOLD,
+    workers: int = 1,
 ) -> None:
-    client = openai.OpenAI()
-    records = []
+    """Scan, chunk, embed and publish the corpus index as a streaming pipeline.
 
-    for filepath in iter_text_files(source_dirs):
-        raw_text = filepath.read_text(encoding="utf-8", errors="ignore")
-        normalized = normalize_text(raw_text)
-        chunks = chunk_text(normalized, chunk_size, overlap)
-        try:
-            rel_path = filepath.relative_to(Path.cwd())
-        except ValueError:
-            rel_path = filepath
-
-        for idx, chunk in enumerate(chunks):
-            records.append(
-                {
+    Neither texts nor vectors sit in memory as a whole. Chunk records are spooled to
+    disk as files are read; with the OpenAI provider and dedupe off, new texts are
+    embedded into the embedding store while ingestion continues. Vectors go to an on-disk spool in
+    committed batches (resumable with ``resume``), the per-record matrix is
+    assembled on disk, and the binary index is written from the memory map.
+    """
+    files: Dict[str, Dict[str, object]] = {}
+    file_shards: Dict[str, Optional[str]] = {}
+    skipped: Dict[str, str] = {}
+
+    # Shard of each source seen; shard_names reads corpus_sources.json on every call
+    source_shards: Dict[str, str] = {}
+
+    def in_shard(source: str) -> bool:
+        if source not in source_shards:
+            source_shards[source] = knowledge_base.shard_names([source], shard_by)[0]
+        return source_shards[source] == only_shard
+
+    previous = read_manifest()
+    previous_files: Dict[str, Dict[str, object]] = previous.get("files", {})
+    shard_manifest = knowledge_base.read_shard_manifest(BINARY_INDEX_DIR) if only_shard else None
+    if only_shard:
+        if shard_manifest is None:
+            raise SystemExit(f"No sharded index at {BINARY_INDEX_DIR}; build all shards first.")
+        if shard_manifest["provider"].get("name") != provider_name or (
+            provider_name == "openai" and shard_manifest["provider"].get("model") != model
+        ):
+            raise SystemExit(f"Shard {only_shard!r} must use the index's provider {shard_manifest['provider']}.")
+
+    settings = {
+        "provider": provider_name,
+        "model": model if provider_name == "openai" else embedding_providers.LOCAL_MODEL,
+        "dimensions": dimensions,
+        "chunk_size_words": chunk_size,
+        "chunk_overlap_words": overlap,
+        "storage": storage,
+        "ann": ann,
+        "ann_lists": ann_lists,
+        "shard_by": shard_by,
+        "dedupe_threshold": dedupe_threshold,
+        # Indexes from before chunks carried source spans are republished once
+        "chunk_spans": True,
+    }
+
+    # API vectors depend only on (model, requested width, text), so they outlive any one
+    # index: re-chunking or reverting a file pays only for text never embedded before.
+    # Local vectors depend on the trained model and are cheap to recompute.
+    remote = embedding_providers.OpenAIProvider(model, dimensions) if provider_name == "openai" else None
+    store = embedding_cache.EmbeddingStore(embedding_store) if embedding_store and remote is not None else None
+    store_key = (model, dimensions or 0)
+    limiter = embedding_providers.RateLimiter(requests_per_minute, tokens_per_minute) if remote is not None else None
+    # Chunks the published index already has are reused, not prefetched
+    known = set()
+    if same_vector_space(previous, settings):
+        known = {digest for info in previous_files.values() for digest in info.get("chunks", ())}
+
+    # Local training and the resume plan need the whole corpus, but without dedupe
+    # API embedding of new texts can start with the first file. Which near-duplicate
+    # is kept depends on every file, so with dedupe nothing is embedded before it runs
+    prefetch = store is not None and not full and not dedupe_threshold
+    BUILD_DIR.mkdir(parents=True, exist_ok=True)
+    records = RecordSpool(RECORDS_PATH)
+    sources: List[str] = []
+    hashes: List[str] = []
+    max_input_tokens = embedding_providers.MAX_INPUT_TOKENS[provider_name]
+    ingest_stats: Dict[str, float] = {}
+    ingest_started = time.perf_counter()
+
+    def ingest() -> Iterator[Tuple[str, str]]:
+        """Spool each file's records; yield (digest, text) for texts neither the index nor the store has."""
+        for filepath, source, file_hash, chunks, chunk_hashes, spans in iter_source_chunks(
+            source_dirs, chunk_size, overlap, max_input_tokens, workers=workers, stats=ingest_stats, skipped=skipped
+        ):
+            files[source] = {"sha256": file_hash, "chunks": chunk_hashes}
+            file_shards[source] = knowledge_base.shard_names([source], shard_by)[0] if shard_by else None
+            if only_shard and file_shards[source] != only_shard:
+                continue
+            for idx, (chunk, span) in enumerate(zip(chunks, spans)):
+                record = {
                     "id": f"{filepath.stem}-chunk-{idx}",
-                    "source": str(rel_path),
+                    "source": source,
+                    "ordinal": idx,
                     "text": chunk,
+                    "span": span,
                 }
-            )
+                if shard_by:
+                    record["shard"] = file_shards[source]
+                records.append(record)
+                sources.append(source)
+                hashes.append(chunk_hashes[idx])
+            if prefetch:
+                new = {digest: chunk for digest, chunk in zip(chunk_hashes, chunks) if digest not in known}
+                present = store.present(*store_key, new)
+                for digest, chunk in new.items():
+                    if digest not in present:
+                        known.add(digest)
+                        yield digest, chunk
 
-    if not records:
+    prefetched = set()
+    try:
+        if prefetch:
+            prefetched = prefetch_to_store(remote, ingest(), store, store_key, batch_tokens, batch_size, parallelism, limiter)
+        else:
+            deque(ingest(), maxlen=0)
+    finally:
+        records.close()
+
+    report_ingest(ingest_stats, time.perf_counter() - ingest_started, workers)
+    # A catalogued source must not silently drop out of the index
+    listed = sorted(source for source in skipped if source in knowledge_base.read_source_metadata())
+    if listed:
+        RECORDS_PATH.unlink(missing_ok=True)
+        raise SystemExit(
+            f"{len(listed)} source(s) listed in {knowledge_base.SOURCE_METADATA_PATH} could not be extracted: "
+            + " ".join(skipped[source] for source in listed)
+        )
+    if not any(info["chunks"] for info in files.values()):
         raise SystemExit("No text chunks found. Check your data directories.")
+    if not records:
+        raise SystemExit(f"No text chunks belong to shard {only_shard!r}.")
+
+    if only_shard:
+        files = {source: info for source, info in files.items() if file_shards[source] == only_shard}
+        # Resolve every indexed source's shard in one pass before filtering and carrying over
+        source_shards.update(zip(previous_files, knowledge_base.shard_names(list(previous_files), shard_by)))
+        other_files = {source: info for source, info in previous_files.items() if not in_shard(source)}
+        previous_files = {source: info for source, info in previous_files.items() if in_shard(source)}
+    else:
+        other_files = {}
+
+    if not full and previous.get("build") == settings and previous_files == files and knowledge_base.index_available():
+        RECORDS_PATH.unlink(missing_ok=True)
+        if store is not None:
+            store.close()
+        print(f"Index is up to date ({len(files)} files unchanged); nothing to embed.")
+        report_skipped(skipped)
+        return
+
+    if dedupe_threshold:
+        dedupe_started = time.perf_counter()
+        before = len(records)
+        kept_rows = collapse_duplicates(records, [file_shards[source] for source in sources], dedupe_threshold)
+        records = records.subset(kept_rows)
+        sources = [sources[pos] for pos in kept_rows]
+        hashes = [hashes[pos] for pos in kept_rows]
+        elapsed = time.perf_counter() - dedupe_started
+        print(f"Near-duplicate check: {before} chunks in {elapsed:.2f}s ({before / max(elapsed, 1e-9):.0f} chunks/s).")
+
+    index_rows, index = ({}, None) if full else previous_index_rows(previous, settings)
+    previous_embedder = index.get("embedder") if index is not None else None
+
+    embedder: Optional[embedding_providers.LocalProvider] = None
+    if provider_name == "local" and previous_embedder is not None and not only_shard:
+        # Stored vectors live in this model's space; --full retrains on the current corpus
+        embedder = previous_embedder
+        provider = embedder
+    elif provider_name == "local" and only_shard:
+        # Every shard must embed into the same space, so reuse the index's trained model
+        if not shard_manifest.get("embedder"):
+            raise SystemExit("The sharded index has no local embedder; rebuild all shards.")
+        provider = embedding_providers.LocalProvider.load(BINARY_INDEX_DIR / shard_manifest["embedder"])
+    elif provider_name == "local":
+        # Trained on the chunks it will embed (deterministically, so --resume matches);
+        # saved with the index for query time
+        embedder = embedding_providers.LocalProvider.train(
+            records.column("text"),
+            dimensions or embedding_providers.LOCAL_DIMENSIONS,
+        )
+        provider = embedder
+    else:
+        provider = remote
 
     INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
     MANIFEST_PATH.parent.mkdir(parents=True, exist_ok=True)
+    if not resume and CHECKPOINT_PATH.exists():
+        print("Discarding the checkpoint of an interrupted build (pass --resume to continue it).")
 
-    with INDEX_PATH.open("w", encoding="utf-8") as index_file:
-        for batch in batched(records, batch_size):
-            inputs = [rec["text"] for rec in batch]
-            response = client.embeddings.create(model=model, input=inputs)
-            for rec, emb in zip(batch, response.data):
-                rec_with_embedding = {
-                    **rec,
-                    "embedding": emb.embedding,
-                    "model": model,
-                }
-                index_file.write(json.dumps(rec_with_embedding) + "\n")
+    # Each distinct text the published index lacks is embedded (or fetched) once
+    first_row = {digest: pos for pos, digest in reversed(list(enumerate(hashes)))}
+    needed = sorted(pos for digest, pos in first_row.items() if digest not in index_rows)
+    needed_hashes = [hashes[pos] for pos in needed]
+    plan = content_hash(json.dumps({"settings": settings, "shard": only_shard, "needed": needed_hashes}))
+
+    spool, counts = embed_to_spool(
+        provider,
+        records.subset(needed).column("text"),
+        needed_hashes,
+        plan,
+        resume,
+        None if full else store,
+        store_key,
+        batch_tokens,
+        batch_size,
+        parallelism,
+        limiter,
+    )
+    # Prefetched vectors reach the spool through the store; report them as embedded
+    fresh = sum(1 for digest in needed_hashes[counts["resumed"] :] if digest in prefetched)
+    counts["embedded"] += fresh
+    counts["from_store"] -= fresh
+    if store is not None:
+        if full and spool is not None:
+            # Block by block: put_many holds a whole call's rows in memory
+            for start in range(0, len(needed_hashes), ASSEMBLE_BLOCK_ROWS):
+                block = needed_hashes[start : start + ASSEMBLE_BLOCK_ROWS]
+                store.put_many(*store_key, zip(block, spool[start : start + len(block)]))
+        # Backfill vectors this index already had, so later sweeps find them too
+        reused = [digest for digest in first_row if digest in index_rows]
+        missing = sorted(set(reused) - store.present(*store_key, reused), key=index_rows.get)
+        for start in range(0, len(missing), ASSEMBLE_BLOCK_ROWS):
+            block = missing[start : start + ASSEMBLE_BLOCK_ROWS]
+            rows = np.array([index_rows[digest] for digest in block], dtype=np.int64)
+            store.put_many(*store_key, zip(block, knowledge_base._row_vectors(index, rows)))
+        store.maintain()
+        store.close()
+
+    write_started = time.perf_counter()
+    matrix = assemble_matrix(hashes, spool, {digest: row for row, digest in enumerate(needed_hashes)}, index, index_rows)
+    del spool
+
+    # Write a temp file and rename at the end so readers never load a partial index
+    tmp_index_path = INDEX_PATH.with_name(f".{INDEX_PATH.name}.{os.getpid()}.tmp")
+    kept: List[Dict[str, object]] = []
+    try:
+        with tmp_index_path.open("w", encoding="utf-8") as index_file:
+            if only_shard and INDEX_PATH.exists():
+                # Carry over the other shards' lines unchanged
+                with INDEX_PATH.open("r", encoding="utf-8") as previous_index:
+                    for line in previous_index:
+                        rec = json.loads(line) if line.strip() else None
+                        if rec and not in_shard(rec["source"]):
+                            kept.append({"source": rec["source"]})
+                            index_file.write(line if line.endswith("\n") else line + "\n")
+            spooled = iter(records)
+            for start in range(0, len(records), ASSEMBLE_BLOCK_ROWS):
+                block = matrix[start : start + ASSEMBLE_BLOCK_ROWS].tolist()
+                for rec, embedding in zip(spooled, block):
+                    rec_with_embedding = {
+                        **rec,
+                        "embedding": embedding,
+                        "model": provider.model,
+                        "dimensions": len(embedding),
+                    }
+                    index_file.write(json.dumps(rec_with_embedding) + "\n")
+    except BaseException:
+        tmp_index_path.unlink(missing_ok=True)
+        raise
+
+    if only_shard and shard_manifest["provider"].get("dimensions") not in (None, matrix.shape[1]):
+        tmp_index_path.unlink(missing_ok=True)
+        raise SystemExit(f"Shard {only_shard!r} is {matrix.shape[1]}-d; the index is {shard_manifest['provider']['dimensions']}-d.")
+
+    shard_counts: Dict[str, int] = {}
+    if shard_by:
+        record_shards = [file_shards[source] for source in sources]
+        for name in sorted(set(record_shards)):
+            rows = [pos for pos, shard in enumerate(record_shards) if shard == name]
+            knowledge_base.write_binary_index(
+                BINARY_INDEX_DIR / knowledge_base.SHARDS_DIR / name,
+                provider.model,
+                matrix[rows],
+                records.subset(rows),
+                storage=storage,
+                ann=ann,
+                # The IVF list count scales with the shard, not the corpus
+                ann_lists=ann_lists and max(1, round(ann_lists * math.sqrt(len(rows) / len(records)))),
+                provider=provider.describe(),
+            )
+            shard_counts[name] = len(rows)
+        if only_shard and MANIFEST_PATH.exists():
+            previous_counts = json.loads(MANIFEST_PATH.read_text(encoding="utf-8")).get("shards", {})
+            shard_counts = {**previous_counts, **shard_counts}
+        generation = knowledge_base.write_shard_manifest(
+            BINARY_INDEX_DIR,
+            list(shard_manifest["shards"]) + [only_shard] if only_shard else list(shard_counts),
+            provider.describe(),
+            embedder=embedder,
+        )
+    else:
+        generation = knowledge_base.write_binary_index(
+            BINARY_INDEX_DIR,
+            provider.model,
+            matrix,
+            records,
+            storage=storage,
+            ann=ann,
+            ann_lists=ann_lists,
+            provider=provider.describe(),
+            embedder=embedder,
+        )
+    os.replace(tmp_index_path, INDEX_PATH)
+    records.close()
 
     manifest = {
-        "model": model,
+        "provider": provider.name,
+        "model": provider.model,
+        "dimensions": int(matrix.shape[1]),
         "chunk_size_words": chunk_size,
         "chunk_overlap_words": overlap,
-        "total_chunks": len(records),
-        "sources": sorted({rec["source"] for rec in records}),
+        "total_chunks": len(records) + len(kept),
+        "index_generation": generation,
+        "sources": sorted(set(sources) | {rec["source"] for rec in kept}),
     }
-    MANIFEST_PATH.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    if shard_by:
+        manifest["shard_by"] = shard_by
+        manifest["shards"] = shard_counts
+    # Per-file and per-chunk content hashes let the next run skip unchanged work
+    manifest["build"] = settings
+    manifest["files"] = {**other_files, **files}
+    knowledge_base.write_text_atomic(MANIFEST_PATH, json.dumps(manifest, indent=2))
 
-    print(f"Indexed {manifest['total_chunks']} chunks from {len(manifest['sources'])} files.")
+    del matrix
+    shutil.rmtree(BUILD_DIR, ignore_errors=True)
+    elapsed = time.perf_counter() - write_started
+    print(f"Assembled and published {len(records)} chunks in {elapsed:.2f}s ({len(records) / max(elapsed, 1e-9):.0f} chunks/s).")
+
+    print(
+        f"Indexed {manifest['total_chunks']} chunks from {len(manifest['sources'])} files "
+        f"({counts['embedded']} embedded, {counts['from_store']} from the embedding store, "
+        f"{counts['resumed']} from the checkpoint, {sum(1 for digest in hashes if digest in index_rows)} reused from the index)."
+    )
+    report_skipped(skipped)
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Build Vonnegut corpus embedding index")
+    parser.add_argument(
+        "--provider",
+        choices=embedding_providers.PROVIDERS,
+        default="openai",
+        help="Embedding provider; 'local' trains a TF-IDF + SVD model and needs no API key (default: %(default)s)",
+    )
     parser.add_argument(
         "--model",
         default=DEFAULT_MODEL,
@@ -156,8 +1013,32 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--batch-size",
         type=int,
-        default=20,
-        help="Embedding requests per batch (default: %(default)s)",
+        default=embedding_providers.MAX_REQUEST_INPUTS,
+        help="Most chunks per embedding request (default: %(default)s, the API limit)",
+    )
+    parser.add_argument(
+        "--batch-tokens",
+        type=int,
+        default=embedding_providers.MAX_REQUEST_TOKENS,
+        help="Most tokens per embedding request; batches are packed up to this (default: %(default)s, the API limit)",
+    )
+    parser.add_argument(
+        "--parallelism",
+        type=int,
+        default=embedding_providers.DEFAULT_PARALLELISM,
+        help="Embedding batches in flight at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--requests-per-minute",
+        type=int,
+        default=embedding_providers.DEFAULT_REQUESTS_PER_MINUTE,
+        help="OpenAI request rate limit; 0 disables (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--tokens-per-minute",
+        type=int,
+        default=embedding_providers.DEFAULT_TOKENS_PER_MINUTE,
+        help="OpenAI token rate limit, estimated at ~4 characters per token; 0 disables (default: %(default)s)",
     )
     parser.add_argument(
         "--source",
@@ -165,11 +1046,106 @@ def parse_args() -> argparse.Namespace:
         dest="sources",
         help="Optional directory to include (can be passed multiple times). Defaults include data/vonnegut_corpus, data/raw, data/excerpts.",
     )
+    parser.add_argument(
+        "--dimensions",
+        type=int,
+        default=None,
+        help="Truncated embedding width, e.g. 256, 512 or 1024 (default: the model's full width; 256 for --provider local)",
+    )
+    parser.add_argument(
+        "--storage",
+        choices=knowledge_base.STORAGE_MODES,
+        default="float32",
+        help="Scan-matrix precision for the binary index; quantized modes rescore in float32 (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--ann",
+        action="store_true",
+        help="Also build an IVF approximate nearest-neighbour index for large corpora",
+    )
+    parser.add_argument(
+        "--ann-lists",
+        type=int,
+        default=None,
+        help="IVF list count (default: about sqrt(total chunks))",
+    )
+    parser.add_argument(
+        "--shard-by",
+        choices=knowledge_base.SHARD_KEYS,
+        default=None,
+        help="Write one binary index shard per collection or source directory, searched in parallel",
+    )
+    parser.add_argument(
+        "--shard",
+        default=None,
+        help="With --shard-by, re-embed and republish only this shard; the others are left untouched",
+    )
+    parser.add_argument(
+        "--embedding-store",
+        type=Path,
+        default=embedding_cache.DEFAULT_STORE_PATH,
+        help="SQLite store of OpenAI chunk vectors keyed by model, width and text hash (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-embedding-store",
+        action="store_true",
+        help="Neither read nor write the embedding store",
+    )
+    parser.add_argument(
+        "--dedupe-threshold",
+        type=float,
+        default=near_duplicates.DEFAULT_THRESHOLD,
+        help="Collapse chunks whose 5-word-shingle Jaccard similarity reaches this into one chunk "
+        "with source aliases (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-dedupe",
+        action="store_true",
+        help="Index every chunk, even near-duplicates",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes for reading, normalizing and chunking files; output order is unchanged (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted build from its last committed embedding batch",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Re-embed every chunk (and retrain the local model) instead of reusing unchanged vectors",
+    )
+    parser.add_argument(
+        "--convert-jsonl",
+        action="store_true",
+        help=f"Convert the existing {INDEX_PATH} into the binary index at {BINARY_INDEX_DIR} without re-embedding",
+    )
     return parser.parse_args()
 
 
 def main() -> None:
     args = parse_args()
+    if args.convert_jsonl:
+        if not INDEX_PATH.exists():
+            raise SystemExit(f"{INDEX_PATH} not found. Build the index first.")
+        count = knowledge_base.convert_jsonl_index(
+            INDEX_PATH,
+            BINARY_INDEX_DIR,
+            storage=args.storage,
+            ann=args.ann,
+            ann_lists=args.ann_lists,
+            dimensions=args.dimensions,
+        )
+        print(f"Converted {count} chunks into {BINARY_INDEX_DIR} ({args.storage}).")
+        return
+
+    if args.shard and not args.shard_by:
+        raise SystemExit("--shard needs --shard-by.")
+
     custom_dirs = [Path(src) for src in (args.sources or [])]
     source_dirs = custom_dirs or DEFAULT_SOURCE_DIRS
 
@@ -177,7 +1153,7 @@ def main() -> None:
     if missing:
         print(f"⚠️ Warning: Skipping missing directories: {', '.join(missing)}")
 
-    if not os.getenv("OPENAI_API_KEY"):
+    if args.provider == "openai" and not os.getenv("OPENAI_API_KEY"):
         raise SystemExit("OPENAI_API_KEY is not set. Export it before running this script.")
 
     build_index(
@@ -186,6 +1162,22 @@ def main() -> None:
         overlap=args.chunk_overlap,
         batch_size=args.batch_size,
         source_dirs=source_dirs,
+        storage=args.storage,
+        ann=args.ann,
+        ann_lists=args.ann_lists,
+        dimensions=args.dimensions,
+        provider_name=args.provider,
+        shard_by=args.shard_by,
+        only_shard=args.shard,
+        full=args.full,
+        batch_tokens=args.batch_tokens,
+        embedding_store=None if args.no_embedding_store else args.embedding_store,
+        parallelism=args.parallelism,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+        resume=args.resume,
+        dedupe_threshold=None if args.no_dedupe else args.dedupe_threshold,
+        workers=args.workers,
     )
 
 
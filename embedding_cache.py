@@ -0,0 +1,355 @@
+"""Two-tier cache for query embeddings and retrieval results.
+
+Tier one is an in-process LRU; tier two is a SQLite file shared by every process
+on the host, so a repeated question skips the embeddings round-trip even after a
+restart. Entries are evicted least-recently-used once the file exceeds its byte
+budget.
+
+EmbeddingStore is the build-time counterpart: chunk vectors addressed by
+(model, dimensions, sha256 of the text), so re-chunking or rebuilding only pays
+for text the store has never seen.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = Path(os.getenv("QUERY_CACHE_PATH", "data/cache/query_embeddings.sqlite"))
+DEFAULT_MEMORY_ITEMS = int(os.getenv("QUERY_CACHE_MEMORY_ITEMS", "1024"))
+DEFAULT_MAX_DISK_BYTES = int(float(os.getenv("QUERY_CACHE_MAX_MB", "64")) * 1024 * 1024)
+# Evict down to this fraction of the budget so we don't prune on every insert
+EVICT_TO_FRACTION = 0.9
+
+DEFAULT_STORE_PATH = Path(os.getenv("EMBEDDING_STORE_PATH", "data/cache/chunk_embeddings.sqlite"))
+DEFAULT_STORE_MAX_BYTES = int(float(os.getenv("EMBEDDING_STORE_MAX_MB", "2048")) * 1024 * 1024)
+# VACUUM once this share of the file is free pages left behind by eviction
+COMPACT_FREE_FRACTION = 0.25
+# Keys per IN (...) lookup, under SQLite's bound-parameter limit
+LOOKUP_BATCH = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    bytes INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+"""
+
+
+def normalize_query(text: str) -> str:
+    """Unicode-normalize and collapse whitespace so trivially different inputs share an entry."""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def embedding_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+
+def results_key(query_vec: Sequence[float], query_text: str, params: Dict[str, object]) -> str:
+    """Key for a retrieval result: the query vector bytes plus every argument that shapes the ranking."""
+    digest = hashlib.sha256(np.asarray(query_vec, dtype=np.float32).tobytes())
+    digest.update(normalize_query(query_text).encode("utf-8"))
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class QueryCache:
+    def __init__(
+        self,
+        path: Optional[Path] = DEFAULT_CACHE_PATH,
+        memory_items: int = DEFAULT_MEMORY_ITEMS,
+        max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES,
+    ) -> None:
+        self.memory_items = memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+
+    # -- in-process tier -------------------------------------------------
+
+    def _memory_get(self, key: str) -> Optional[object]:
+        value = self._memory.get(key)
+        if value is not None:
+            self._memory.move_to_end(key)
+        return value
+
+    def _memory_put(self, key: str, value: object) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    # -- disk tier -------------------------------------------------------
+
+    def _disk_get(self, table: str, column: str, key: str) -> Optional[object]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(f"SELECT {column} FROM {table} WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._db.execute(f"UPDATE {table} SET last_used = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.Error:
+            # A locked or damaged cache file must never break a chat turn
+            return None
+        return row[0] if row is not None else None
+
+    def _disk_total_bytes(self) -> int:
+        total = 0
+        for table in ("embeddings", "results"):
+            total += self._db.execute(f"SELECT COALESCE(SUM(bytes), 0) FROM {table}").fetchone()[0]
+        return int(total)
+
+    def _evict(self) -> None:
+        """Drop least-recently-used rows (across both tables) until under budget."""
+        total = self._disk_total_bytes()
+        if total <= self.max_disk_bytes:
+            return
+        excess = total - int(self.max_disk_bytes * EVICT_TO_FRACTION)
+        rows = self._db.execute(
+            "SELECT 'embeddings', key, bytes, last_used FROM embeddings "
+            "UNION ALL SELECT 'results', key, bytes, last_used FROM results ORDER BY last_used"
+        )
+        doomed: List[tuple] = []
+        for table, key, size, _ in rows:
+            if excess <= 0:
+                break
+            doomed.append((table, key))
+            excess -= size
+        for table, key in doomed:
+            self._db.execute(f"DELETE FROM {table} WHERE key = ?", (key,))
+        self.stats["evictions"] += len(doomed)
+
+    def _disk_put(self, sql: str, params: tuple) -> None:
+        if self._db is None:
+            return
+        try:
+            self._db.execute(sql, params)
+            self._evict()
+        except sqlite3.Error:
+            pass
+
+    # -- public API ------------------------------------------------------
+
+    def get_embedding(self, model: str, text: str) -> Optional[np.ndarray]:
+        key = embedding_key(model, text)
+        with self._lock:
+            vector = self._memory_get(key)
+            if vector is not None:
+                self.stats["memory_hits"] += 1
+                return vector
+            blob = self._disk_get("embeddings", "vector", key)
+            if blob is None:
+                self.stats["misses"] += 1
+                return None
+            vector = np.frombuffer(blob, dtype=np.float32)
+            self._memory_put(key, vector)
+            self.stats["disk_hits"] += 1
+            return vector
+
+    def put_embedding(self, model: str, text: str, vector: Sequence[float]) -> None:
+        key = embedding_key(model, text)
+        array = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._memory_put(key, array)
+            blob = array.tobytes()
+            self._disk_put(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, bytes, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, model, blob, len(blob), time.time()),
+            )
+
+    def get_results(self, key: str) -> Optional[List[Dict[str, object]]]:
+        with self._lock:
+            results = self._memory_get(f"results:{key}")
+            if results is not None:
+                self.stats["memory_hits"] += 1
+                return results
+            payload = self._disk_get("results", "payload", key)
+            if payload is None:
+                self.stats["misses"] += 1
+                return None
+            results = json.loads(payload)
+            self._memory_put(f"results:{key}", results)
+            self.stats["disk_hits"] += 1
+            return results
+
+    def put_results(self, key: str, results: List[Dict[str, object]]) -> None:
+        payload = json.dumps(results)
+        with self._lock:
+            self._memory_put(f"results:{key}", results)
+            self._disk_put(
+                "INSERT OR REPLACE INTO results (key, payload, bytes, last_used) VALUES (?, ?, ?, ?)",
+                (key, payload, len(payload), time.time()),
+            )
+
+    def hit_rate(self) -> float:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        lookups = hits + self.stats["misses"]
+        return hits / lookups if lookups else 0.0
+
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunk_embeddings (
+    model TEXT NOT NULL,
+    dimensions INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    bytes INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (model, dimensions, sha256)
+);
+CREATE INDEX IF NOT EXISTS chunk_embeddings_last_used ON chunk_embeddings (last_used);
+"""
+
+
+class EmbeddingStore:
+    """Content-addressed chunk embeddings that outlive any one index build.
+
+    ``dimensions`` is the width requested from the model (0 for its native width),
+    so Matryoshka-truncated and full vectors never mix.
+    """
+
+    def __init__(self, path: Path = DEFAULT_STORE_PATH, max_bytes: int = DEFAULT_STORE_MAX_BYTES) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(STORE_SCHEMA)
+
+    def get_many(self, model: str, dimensions: int, digests: Iterable[str]) -> Dict[str, np.ndarray]:
+        digests = list(dict.fromkeys(digests))
+        found: Dict[str, np.ndarray] = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(digests), LOOKUP_BATCH):
+                batch = digests[start : start + LOOKUP_BATCH]
+                marks = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT sha256, vector FROM chunk_embeddings WHERE model = ? AND dimensions = ? AND sha256 IN ({marks})",
+                    (model, dimensions, *batch),
+                ).fetchall()
+                for digest, blob in rows:
+                    found[digest] = np.frombuffer(blob, dtype=np.float32)
+                self._db.executemany(
+                    "UPDATE chunk_embeddings SET last_used = ? WHERE model = ? AND dimensions = ? AND sha256 = ?",
+                    [(now, model, dimensions, digest) for digest, _ in rows],
+                )
+            self.stats["hits"] += len(found)
+            self.stats["misses"] += len(digests) - len(found)
+        return found
+
+    def present(self, model: str, dimensions: int, digests: Iterable[str]) -> set:
+        """Which of ``digests`` the store holds, without reading the vectors."""
+        digests = list(dict.fromkeys(digests))
+        found = set()
+        with self._lock:
+            for start in range(0, len(digests), LOOKUP_BATCH):
+                batch = digests[start : start + LOOKUP_BATCH]
+                marks = ",".join("?" * len(batch))
+                found.update(
+                    row[0]
+                    for row in self._db.execute(
+                        f"SELECT sha256 FROM chunk_embeddings WHERE model = ? AND dimensions = ? AND sha256 IN ({marks})",
+                        (model, dimensions, *batch),
+                    )
+                )
+        return found
+
+    def put_many(self, model: str, dimensions: int, items: Iterable[Tuple[str, Sequence[float]]]) -> None:
+        now = time.time()
+        rows = []
+        for digest, vector in items:
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((model, dimensions, digest, blob, len(blob), now))
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT OR REPLACE INTO chunk_embeddings (model, dimensions, sha256, vector, bytes, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._db.execute("COMMIT")
+            self.stats["writes"] += len(rows)
+
+    def total_bytes(self) -> int:
+        return int(self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM chunk_embeddings").fetchone()[0])
+
+    def evict(self) -> int:
+        """Drop least-recently-used vectors until the store is under its byte budget."""
+        with self._lock:
+            total = self.total_bytes()
+            if total <= self.max_bytes:
+                return 0
+            excess = total - int(self.max_bytes * EVICT_TO_FRACTION)
+            doomed = []
+            for rowid, size in self._db.execute("SELECT rowid, bytes FROM chunk_embeddings ORDER BY last_used"):
+                if excess <= 0:
+                    break
+                doomed.append((rowid,))
+                excess -= size
+            self._db.executemany("DELETE FROM chunk_embeddings WHERE rowid = ?", doomed)
+            self.stats["evictions"] += len(doomed)
+            return len(doomed)
+
+    def compact(self, force: bool = False) -> bool:
+        """VACUUM when evictions left enough free pages to be worth rewriting the file."""
+        with self._lock:
+            pages = self._db.execute("PRAGMA page_count").fetchone()[0]
+            free = self._db.execute("PRAGMA freelist_count").fetchone()[0]
+            if not force and (not pages or free / pages < COMPACT_FREE_FRACTION):
+                return False
+            self._db.execute("VACUUM")
+            return True
+
+    def maintain(self) -> None:
+        """Evict to budget, then compact if that freed enough space; run once per build."""
+        if self.evict():
+            self.compact()
+
+    def close(self) -> None:
+        self._db.close()
+
+
+_default_cache: Optional[QueryCache] = None
+_default_lock = threading.Lock()
+
+
+def get_query_cache() -> QueryCache:
+    """Process-wide cache; lives in this module so Streamlit reruns keep the warm LRU."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            try:
+                _default_cache = QueryCache()
+            except sqlite3.Error:
+                # Read-only or full disk: keep the in-process tier at least
+                _default_cache = QueryCache(path=None)
+        return _default_cache
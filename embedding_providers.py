@@ -0,0 +1,468 @@
+"""Embedding providers for building and querying the corpus index.
+
+``openai`` calls the embeddings API. ``local`` is a hashed TF-IDF model projected
+by a truncated SVD trained on the corpus itself; its weights are saved beside the
+index, so query embedding needs no network and takes well under a millisecond.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import random
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import lexical_index
+
+# Exact token counts when installed; a calibrated estimate otherwise
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+PROVIDERS = ("openai", "local")
+LOCAL_MODEL = "local-tfidf-svd"
+
+# Unigrams and bigrams hash into this many signed buckets
+HASH_FEATURES = 1 << 16
+LOCAL_DIMENSIONS = 256
+# Randomized SVD (Halko et al.): oversampled range finder plus a few power iterations
+SVD_OVERSAMPLE = 10
+SVD_POWER_ITERATIONS = 3
+SEGMENT_BLOCK = 4096
+# Texts embedded per sparse product; bounds the temporaries however large the request
+LOCAL_EMBED_ROWS = 32
+# Default deadline for aembed; a voice turn would rather fall back to keyword search than wait
+EMBED_TIMEOUT_SECONDS = 2.0
+
+# Index builds: concurrent requests under OpenAI's per-minute limits (tier-1 defaults)
+DEFAULT_PARALLELISM = 4
+DEFAULT_REQUESTS_PER_MINUTE = 3000
+DEFAULT_TOKENS_PER_MINUTE = 1_000_000
+RETRY_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+RETRYABLE_STATUS = {408, 409, 429}
+
+# OpenAI embeddings limits: tokens per input, total tokens and inputs per request
+MAX_INPUT_TOKENS = {"openai": 8191, "local": None}
+MAX_REQUEST_TOKENS = 300_000
+MAX_REQUEST_INPUTS = 2048
+# ~0.75 words per token for English prose with the OpenAI tokenizers
+TOKENS_PER_WORD = 4 / 3
+# Estimated counts can run low on unusual text; pack to this share of each limit
+ESTIMATE_HEADROOM = 0.9
+
+Csr = Tuple[np.ndarray, np.ndarray, np.ndarray]  # (indptr, indices, data)
+
+
+def _hashed_terms(text: str) -> Dict[int, float]:
+    """Signed, sublinear term frequencies keyed by hash bucket.
+
+    crc32 rather than hash(): bucket ids must be identical in every process.
+    """
+    tokens = lexical_index.tokenize(text)
+    counts = Counter(tokens)
+    counts.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    features: Dict[int, float] = {}
+    for term, count in counts.items():
+        digest = zlib.crc32(term.encode("utf-8"))
+        bucket = digest & (HASH_FEATURES - 1)
+        sign = -1.0 if digest & 0x80000000 else 1.0
+        features[bucket] = features.get(bucket, 0.0) + sign * (1.0 + math.log(count))
+    return features
+
+
+def _hashed_matrix(texts: Sequence[str]) -> Csr:
+    indptr = np.zeros(len(texts) + 1, dtype=np.int64)
+    indices: List[int] = []
+    data: List[float] = []
+    for row, text in enumerate(texts):
+        features = _hashed_terms(text)
+        for bucket in sorted(features):
+            indices.append(bucket)
+            data.append(features[bucket])
+        indptr[row + 1] = len(indices)
+    return indptr, np.asarray(indices, dtype=np.int64), np.asarray(data, dtype=np.float32)
+
+
+def _tfidf(matrix: Csr, idf: np.ndarray) -> Csr:
+    """Scale by idf and L2-normalize each row."""
+    indptr, indices, data = matrix
+    weighted = data * idf[indices]
+    row_of = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    norms = np.sqrt(np.bincount(row_of, weights=weighted.astype(np.float64) ** 2, minlength=len(indptr) - 1))
+    norms[norms == 0] = 1
+    return indptr, indices, (weighted / norms[row_of]).astype(np.float32)
+
+
+def _segment_dot(pointers: np.ndarray, columns: np.ndarray, values: np.ndarray, dense: np.ndarray) -> np.ndarray:
+    """Sparse (CSR or CSC) times dense: output row r sums values * dense[columns] over segment r."""
+    out = np.zeros((len(pointers) - 1, dense.shape[1]), dtype=np.float32)
+    for start in range(0, len(pointers) - 1, SEGMENT_BLOCK):
+        stop = min(start + SEGMENT_BLOCK, len(pointers) - 1)
+        lo, hi = pointers[start], pointers[stop]
+        if lo == hi:
+            continue
+        products = values[lo:hi, None] * dense[columns[lo:hi]]
+        lengths = np.diff(pointers[start : stop + 1])
+        nonempty = np.flatnonzero(lengths)
+        out[start + nonempty] = np.add.reduceat(products, (pointers[start:stop] - lo)[nonempty], axis=0)
+    return out
+
+
+def _transpose(matrix: Csr, n_columns: int) -> Csr:
+    indptr, indices, data = matrix
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    order = np.argsort(indices, kind="stable")
+    pointers = np.zeros(n_columns + 1, dtype=np.int64)
+    pointers[1:] = np.cumsum(np.bincount(indices, minlength=n_columns))
+    return pointers, rows[order], data[order]
+
+
+def _randomized_svd_components(matrix: Csr, dimensions: int, seed: int) -> np.ndarray:
+    """Top right singular vectors of the sparse matrix, shape (HASH_FEATURES x <= dimensions).
+
+    Orthonormalization happens in document space and the final SVD goes through the
+    small (width x width) Gram matrix, so nothing dense is factorized at feature width.
+    """
+    transposed = _transpose(matrix, HASH_FEATURES)
+    rng = np.random.default_rng(seed)
+    width = dimensions + SVD_OVERSAMPLE
+    basis, _ = np.linalg.qr(_segment_dot(*matrix, rng.standard_normal((HASH_FEATURES, width), dtype=np.float32)))
+    for _ in range(SVD_POWER_ITERATIONS):
+        basis, _ = np.linalg.qr(_segment_dot(*matrix, _segment_dot(*transposed, basis)))
+    projected = _segment_dot(*transposed, basis)  # matrix.T @ basis
+    eigenvalues, eigenvectors = np.linalg.eigh(projected.T @ projected)
+    order = np.argsort(eigenvalues)[::-1][:dimensions]
+    singular = np.sqrt(np.maximum(eigenvalues[order], 0))
+    # Drop directions the corpus does not span; dividing by ~0 would only amplify noise
+    order = order[singular > 1e-6 * singular[0]]
+    singular = singular[: len(order)]
+    return np.ascontiguousarray(projected @ eigenvectors[:, order] / singular, dtype=np.float32)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32)
+
+
+class LocalProvider:
+    """Hashed TF-IDF + truncated SVD (latent semantic analysis) trained on the corpus."""
+
+    name = "local"
+    model = LOCAL_MODEL
+
+    def __init__(self, idf: np.ndarray, components: np.ndarray) -> None:
+        self.idf = idf
+        self.components = components
+
+    @property
+    def dimensions(self) -> int:
+        return int(self.components.shape[1])
+
+    @classmethod
+    def train(cls, texts: Sequence[str], dimensions: int = LOCAL_DIMENSIONS, seed: int = 0) -> "LocalProvider":
+        counts = _hashed_matrix(texts)
+        df = np.bincount(counts[1], minlength=HASH_FEATURES)
+        idf = (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+        # The rank of the corpus matrix caps how many components carry signal
+        dimensions = max(1, min(dimensions, len(texts)))
+        return cls(idf, _randomized_svd_components(_tfidf(counts, idf), dimensions, seed))
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        parts = [
+            _segment_dot(*_tfidf(_hashed_matrix(texts[start : start + LOCAL_EMBED_ROWS]), self.idf), self.components)
+            for start in range(0, len(texts), LOCAL_EMBED_ROWS)
+        ]
+        return _normalize(np.concatenate(parts) if parts else np.zeros((0, self.dimensions), dtype=np.float32))
+
+    async def aembed(self, texts: Sequence[str]) -> np.ndarray:
+        # Sub-millisecond for a query, cheaper inline than a thread hop
+        return self.embed(texts)
+
+    def truncated(self, dimensions: int) -> "LocalProvider":
+        """Components are ordered by singular value, so a prefix is the best narrower model."""
+        return LocalProvider(self.idf, np.ascontiguousarray(self.components[:, :dimensions]))
+
+    def describe(self) -> Dict[str, object]:
+        return {"name": self.name, "model": self.model, "dimensions": self.dimensions, "features": HASH_FEATURES}
+
+    def save(self, path: Path) -> None:
+        with path.open("wb") as f:
+            np.savez(f, idf=self.idf, components=self.components)
+
+    @classmethod
+    def load(cls, path: Path) -> "LocalProvider":
+        with np.load(path, allow_pickle=False) as archive:
+            return cls(archive["idf"], archive["components"])
+
+
+class OpenAIProvider:
+    name = "openai"
+
+    def __init__(self, model: str, dimensions: Optional[int] = None, client=None, async_client=None) -> None:
+        if client is None:
+            import openai
+
+            client = openai.OpenAI()
+        self.client = client
+        self.async_client = async_client
+        self.model = model
+        self.requested_dimensions = dimensions
+        self.dimensions: Optional[int] = dimensions
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        # text-embedding-3 models return Matryoshka-truncated, renormalized vectors on request
+        options = {"dimensions": self.requested_dimensions} if self.requested_dimensions else {}
+        response = self.client.embeddings.create(model=self.model, input=list(texts), **options)
+        return self._vectors(response)
+
+    async def aembed(self, texts: Sequence[str]) -> np.ndarray:
+        if self.async_client is None:
+            import openai
+
+            self.async_client = openai.AsyncOpenAI()
+        options = {"dimensions": self.requested_dimensions} if self.requested_dimensions else {}
+        response = await self.async_client.embeddings.create(model=self.model, input=list(texts), **options)
+        return self._vectors(response)
+
+    def _vectors(self, response) -> np.ndarray:
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        self.dimensions = int(vectors.shape[1])
+        return vectors
+
+    def describe(self) -> Dict[str, object]:
+        return {"name": self.name, "model": self.model, "dimensions": self.dimensions}
+
+
+async def aembed(provider, texts: Sequence[str], timeout: Optional[float] = EMBED_TIMEOUT_SECONDS) -> np.ndarray:
+    """Embed without blocking the event loop.
+
+    Raises asyncio.TimeoutError after ``timeout`` seconds; the in-flight request is
+    cancelled, as it is when the awaiting task itself is cancelled.
+    """
+    return await asyncio.wait_for(provider.aembed(texts), timeout)
+
+
+_encoding = None
+
+
+def _tokenizer():
+    """cl100k_base (the text-embedding-3 / ada-002 encoding), or None without tiktoken."""
+    global _encoding, tiktoken
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # The encoding file is fetched on first use; offline builds fall back to the estimate
+            tiktoken = None
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in ``text``: exact with tiktoken, else the larger of the per-word and per-character estimates."""
+    encoding = _tokenizer()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, math.ceil(max(len(text.split()) * TOKENS_PER_WORD, len(text) / 4)))
+
+
+def token_limit(limit: int) -> int:
+    return limit if _tokenizer() is not None else int(limit * ESTIMATE_HEADROOM)
+
+
+def split_to_limit(text: str, max_tokens: Optional[int]) -> List[str]:
+    """``text`` unchanged if it fits ``max_tokens``, else consecutive word runs that each fit."""
+    if max_tokens is None:
+        return [text]
+    return _split(text, token_limit(max_tokens))
+
+
+def _split(text: str, max_tokens: int) -> List[str]:
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return [text]
+    words = text.split()
+    if len(words) <= 1:
+        # One enormous "word" (a URL dump, no spaces): cut by characters instead
+        step = max(1, len(text) * max_tokens // tokens)
+        return [piece for start in range(0, len(text), step) for piece in _split(text[start : start + step], max_tokens)]
+    pieces = math.ceil(tokens / max_tokens)
+    size = math.ceil(len(words) / pieces)
+    parts = [" ".join(words[start : start + size]) for start in range(0, len(words), size)]
+    return [piece for part in parts for piece in _split(part, max_tokens)]
+
+
+def pack_batches(
+    token_counts: Sequence[int],
+    max_tokens: int = MAX_REQUEST_TOKENS,
+    max_inputs: int = MAX_REQUEST_INPUTS,
+) -> List[List[int]]:
+    """Group consecutive inputs into as few requests as fit both limits (greedy is optimal in order)."""
+    max_tokens = token_limit(max_tokens)
+    batches: List[List[int]] = []
+    current: List[int] = []
+    used = 0
+    for position, tokens in enumerate(token_counts):
+        if current and (used + tokens > max_tokens or len(current) >= max_inputs):
+            batches.append(current)
+            current, used = [], 0
+        current.append(position)
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def pack_stream(
+    items: Iterable[Tuple[object, int]],
+    max_tokens: int = MAX_REQUEST_TOKENS,
+    max_inputs: int = MAX_REQUEST_INPUTS,
+) -> Iterator[List[object]]:
+    """``pack_batches`` over a stream of (item, token count): each request is yielded once full."""
+    max_tokens = token_limit(max_tokens)
+    current: List[object] = []
+    used = 0
+    for item, tokens in items:
+        if current and (used + tokens > max_tokens or len(current) >= max_inputs):
+            yield current
+            current, used = [], 0
+        current.append(item)
+        used += tokens
+    if current:
+        yield current
+
+
+class TokenBucket:
+    """Refills continuously at ``rate_per_minute`` units and holds at most one minute's worth."""
+
+    def __init__(self, rate_per_minute: float) -> None:
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """Block until ``amount`` units are available and take them; returns seconds waited."""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60.0)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) * 60.0 / self.capacity
+            time.sleep(delay)
+            waited += delay
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets; a rate of 0 means unlimited."""
+
+    def __init__(
+        self,
+        requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE,
+    ) -> None:
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, tokens: int) -> float:
+        waited = self.requests.acquire(1) if self.requests else 0.0
+        return waited + (self.tokens.acquire(tokens) if self.tokens else 0.0)
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    """Seconds from a Retry-After header on an API error, when the server sent one."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(exc: Exception) -> bool:
+    # Matched by shape so this module needs no openai import: status codes on
+    # APIStatusError, class names for the timeout/connection errors
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    return isinstance(exc, (TimeoutError, ConnectionError)) or type(exc).__name__ in (
+        "APITimeoutError",
+        "APIConnectionError",
+    )
+
+
+_stats_lock = threading.Lock()
+
+
+def _count(stats: Dict[str, float], key: str, amount: float) -> None:
+    with _stats_lock:
+        stats[key] = stats.get(key, 0) + amount
+
+
+def _embed_with_retry(
+    provider,
+    texts: Sequence[str],
+    limiter: Optional[RateLimiter],
+    stats: Dict[str, float],
+    attempts: int,
+) -> np.ndarray:
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    tokens = sum(count_tokens(text) for text in texts) if limiter is not None else 0
+    attempt = 0
+    while True:
+        if limiter is not None:
+            _count(stats, "throttled_seconds", limiter.acquire(tokens))
+        try:
+            return provider.embed(texts)
+        except Exception as exc:
+            attempt += 1
+            if attempt >= attempts or not _is_retryable(exc):
+                raise
+            # Exponential backoff with full jitter, unless the server said how long to wait
+            delay = _retry_after(exc) or random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+            _count(stats, "retries", 1)
+            time.sleep(delay)
+
+
+def embed_in_order(
+    provider,
+    batches: Iterable[Sequence[str]],
+    parallelism: int = DEFAULT_PARALLELISM,
+    limiter: Optional[RateLimiter] = None,
+    stats: Optional[Dict[str, float]] = None,
+    attempts: int = RETRY_ATTEMPTS,
+) -> Iterator[np.ndarray]:
+    """Embed ``batches`` on a thread pool, yielding each batch's vectors in input order.
+
+    At most ``2 * parallelism`` batches are in flight, so memory stays bounded however
+    long the input. Transient errors (429, 5xx, timeouts) are retried with backoff;
+    anything else, or running out of attempts, cancels the queued work and raises.
+    """
+    stats = {} if stats is None else stats
+    window: deque = deque()
+    pool = ThreadPoolExecutor(max_workers=max(1, parallelism), thread_name_prefix="embed")
+    try:
+        for texts in batches:
+            window.append(pool.submit(_embed_with_retry, provider, list(texts), limiter, stats, attempts))
+            if len(window) >= 2 * max(1, parallelism):
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,47 @@
+"""Gunicorn settings picked up automatically by `gunicorn app:app`.
+
+When the served app searches the corpus, the index is loaded once in the master
+before workers fork, so all workers on the host share a single read-only copy
+instead of parsing their own. An app loaded with `--preload` that imports
+knowledge_base opts in automatically; `CORPUS_PRELOAD=1` forces the preload.
+The Flask `app:app` deploy (railway.json) does not retrieve from the corpus, so
+it starts without touching the index or its NumPy dependency.
+"""
+
+import os
+import sys
+
+# "1" always preloads the corpus index, "0" never does; unset follows the served app
+CORPUS_PRELOAD = os.getenv("CORPUS_PRELOAD", "")
+
+
+def _serves_retrieval() -> bool:
+    if CORPUS_PRELOAD in ("0", "1"):
+        return CORPUS_PRELOAD == "1"
+    # With preload_app the app module is imported in the master before on_starting
+    return "knowledge_base" in sys.modules
+
+
+def on_starting(server):
+    if not _serves_retrieval():
+        return
+    try:
+        import knowledge_base
+    except ImportError as exc:
+        server.log.warning("Skipping corpus index preload: %s", exc)
+        return
+    if knowledge_base.index_available():
+        data = knowledge_base.preload_index()
+        server.log.info("Preloaded corpus index (%d chunks) for workers", len(data["chunks"]))
+
+
+def on_reload(server):
+    # SIGHUP after a rebuild: reload in the master so the new workers share the new generation
+    if not _serves_retrieval():
+        return
+    try:
+        import knowledge_base
+    except ImportError:
+        return
+    knowledge_base.clear_cache()
+    on_starting(server)
@@ -2,29 +2,596 @@
 
 from __future__ import annotations
 
+import asyncio
+import bisect
+import fnmatch
+import functools
+import gc
+import heapq
+import itertools
 import json
-from functools import lru_cache
+import os
+import re
+import shutil
+import threading
+import time
+from collections.abc import Sequence as SequenceABC
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
 import numpy as np
 
+import ann_index
+import embedding_providers
+import lexical_index
+
 INDEX_PATH = Path("data/corpus_index.jsonl")
+BINARY_INDEX_DIR = Path("data/corpus_index")
+SOURCE_METADATA_PATH = Path("data/corpus_sources.json")
+
+# Binary index layout (all files live in BINARY_INDEX_DIR)
+BINARY_FORMAT = "vonnegut-corpus-index"
+BINARY_FORMAT_VERSION = 2
+# Version 1 kept chunk texts inside chunks.json; version 2 moved them to TEXTS_FILE
+SUPPORTED_FORMAT_VERSIONS = (1, 2)
+HEADER_FILE = "header.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+SCALES_FILE = "scales.npy"
+EXACT_EMBEDDINGS_FILE = "embeddings_f32.npy"
+CHUNKS_FILE = "chunks.json"
+# Every chunk text concatenated as UTF-8; chunk i is bytes offsets[i]:offsets[i + 1]
+TEXTS_FILE = "texts.npy"
+TEXT_OFFSETS_FILE = "text_offsets.npy"
+LEXICAL_FILE = "lexical.npz"
+ANN_FILE = "ivf.npz"
+# Weights of a local embedding provider, present when the index was built with one
+EMBEDDER_FILE = "embedder.npz"
+
+# Sharded layout: SHARD_MANIFEST_FILE lists complete binary indexes under
+# SHARDS_DIR/<name>/ (one per collection or source directory). Searches fan out
+# over a thread pool (NumPy releases the GIL in the matmul) and heap-merge each
+# shard's top-k; rebuilding one shard reloads only that shard.
+SHARD_FORMAT = "vonnegut-corpus-shards"
+SHARD_MANIFEST_FILE = "shards.json"
+SHARDS_DIR = "shards"
+SHARD_KEYS = ("collection", "directory")
+SHARD_SEARCH_THREADS = int(os.getenv("CORPUS_SHARD_THREADS", "0")) or (os.cpu_count() or 1)
+# Threads behind the asearch* coroutines; bounds how many searches an event loop
+# can have scoring at once, so a burst queues instead of oversubscribing the CPU
+ASYNC_SEARCH_THREADS = int(os.getenv("CORPUS_ASYNC_SEARCH_THREADS", "2"))
+
+# Payload files carry a generation suffix (embeddings.<gen>.npy) and header.json,
+# replaced atomically, names the live generation; readers poll it for changes.
+RELOAD_CHECK_SECONDS = float(os.getenv("CORPUS_INDEX_RELOAD_SECONDS", "5"))
+
+# Matryoshka truncation: text-embedding-3 vectors keep working when cut to a prefix
+# and renormalized. A non-zero value truncates a wider index at load time; query
+# vectors wider than the index are truncated the same way.
+LOAD_DIMENSIONS = int(os.getenv("CORPUS_INDEX_DIMENSIONS", "0"))
+
+# Quantized storage: the scan matrix is float16 or int8 (one float32 scale per row),
+# and the best candidates are rescored against the float32 copy on disk.
+STORAGE_MODES = ("float32", "float16", "int8")
+DEFAULT_RESCORE_FACTOR = 4
+SCAN_BLOCK_ROWS = 2048
+
+# Hybrid retrieval: reciprocal rank fusion over each ranker's top candidates
+RRF_K = 60
+HYBRID_CANDIDATES = 50
+
+# Metadata filters ({"source": glob(s), "collection": ..., "title": ..., "year": int or [start, end]})
+# resolve to one boolean row mask per distinct filter, cached on the loaded index.
+DEFAULT_BOOST_WEIGHT = 0.05
+
+# Diversity re-ranking: maximal marginal relevance over a pool of MMR_POOL_FACTOR * top_k
+# candidates; mmr_lambda=1 is pure relevance, lower values penalize overlap harder.
+MMR_POOL_FACTOR = 5
+MASK_CACHE_SIZE = 64
+YEAR_PATTERN = re.compile(r"(?<!\d)(1[89]\d\d|20\d\d)(?!\d)")
+
+# Context expansion: a hit grows into the chunks before and after it in the same
+# document (source id + ordinal) up to a word budget, merging the overlap between
+# consecutive chunks instead of repeating it.
+MAX_OVERLAP_WORDS = 400
+# Prompt excerpts built from bare (unexpanded) hits are trimmed to this many characters
+REFERENCE_SNIPPET_CHARS = 600
 
 
 def index_available() -> bool:
-    return INDEX_PATH.exists()
+    return any(path.exists() for path in (BINARY_INDEX_DIR / SHARD_MANIFEST_FILE, BINARY_INDEX_DIR / HEADER_FILE, INDEX_PATH))
 
 
-@lru_cache(maxsize=1)
-def _load_index() -> Dict[str, np.ndarray]:
-    if not INDEX_PATH.exists():
-        return {"embeddings": np.zeros((0, 0)), "chunks": []}
+def _empty_index() -> Dict[str, np.ndarray]:
+    return {
+        "embeddings": np.zeros((0, 0), dtype=np.float32),
+        "chunks": [],
+        "sources": [],
+        "source_ids": np.zeros(0, dtype=np.int32),
+        "ordinals": np.zeros(0, dtype=np.int32),
+    }
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def truncate_rows(vectors: np.ndarray, dimensions: Optional[int]) -> np.ndarray:
+    """Keep the first ``dimensions`` columns and renormalize (no-op when already narrower)."""
+    if not dimensions or vectors.ndim != 2 or vectors.shape[1] <= dimensions:
+        return vectors
+    return _normalize_rows(np.ascontiguousarray(vectors[:, :dimensions], dtype=np.float32))
+
+
+def _encode_sources(chunks: Sequence[Dict[str, str]]) -> Tuple[List[str], List[int]]:
+    """Deduplicate chunk source paths into a table plus one table position per chunk."""
+    source_table: List[str] = []
+    source_positions: Dict[str, int] = {}
+    source_ids: List[int] = []
+    for chunk in chunks:
+        source = chunk.get("source") or ""
+        if source not in source_positions:
+            source_positions[source] = len(source_table)
+            source_table.append(source)
+        source_ids.append(source_positions[source])
+    return source_table, source_ids
+
+
+def _encode_aliases(chunks: Sequence[Dict[str, object]], source_table: List[str]) -> Tuple[List[int], List[int]]:
+    """(row, source table position) per alias source; new paths are appended to the table."""
+    positions = {source: pos for pos, source in enumerate(source_table)}
+    alias_rows: List[int] = []
+    alias_ids: List[int] = []
+    for row, chunk in enumerate(chunks):
+        for alias in chunk.get("aliases") or ():
+            if alias not in positions:
+                positions[alias] = len(source_table)
+                source_table.append(alias)
+            alias_rows.append(row)
+            alias_ids.append(positions[alias])
+    return alias_rows, alias_ids
+
+
+def _alias_map(sources: Sequence[str], alias_rows: np.ndarray, alias_ids: np.ndarray) -> Dict[int, List[str]]:
+    aliases: Dict[int, List[str]] = {}
+    for row, source_id in zip(alias_rows.tolist(), alias_ids.tolist()):
+        aliases.setdefault(row, []).append(sources[source_id])
+    return aliases
+
+
+def quantize_rows(vectors: np.ndarray, storage: str) -> Dict[str, np.ndarray]:
+    """Quantize normalized float32 rows for the scan matrix."""
+    if storage == "float32":
+        return {"embeddings": vectors}
+    if storage == "float16":
+        return {"embeddings": vectors.astype(np.float16)}
+    if storage == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1
+        quantized = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return {"embeddings": quantized, "scales": scales.astype(np.float32)}
+    raise ValueError(f"Unknown storage mode {storage!r}; choose from {', '.join(STORAGE_MODES)}.")
+
+
+def _generation_name(filename: str, generation: str) -> str:
+    stem, suffix = filename.rsplit(".", 1)
+    return f"{stem}.{generation}.{suffix}"
+
+
+def _ordinals_by_position(source_ids: np.ndarray) -> np.ndarray:
+    """Each row's position among the rows of its document, in index order."""
+    order = np.argsort(source_ids, kind="stable")
+    sorted_ids = source_ids[order]
+    starts = np.zeros(len(order), dtype=np.int64)
+    boundaries = np.flatnonzero(np.diff(sorted_ids)) + 1
+    starts[boundaries] = boundaries
+    ordinals = np.empty(len(order), dtype=np.int32)
+    ordinals[order] = np.arange(len(order)) - np.maximum.accumulate(starts)
+    return ordinals
+
+
+def _chunk_ordinals(chunks: Sequence[Dict[str, object]], source_ids: np.ndarray) -> np.ndarray:
+    """Recorded chunk ordinals, or index order within each document for older builds."""
+    recorded = [chunk.get("ordinal") for chunk in chunks]
+    if recorded and None not in recorded:
+        return np.asarray(recorded, dtype=np.int32)
+    return _ordinals_by_position(source_ids)
+
+
+def save_texts(path: Path, texts: Sequence[str]) -> np.ndarray:
+    """Write texts as one UTF-8 byte array (.npy) in two streaming passes; returns the (N + 1) byte offsets."""
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.fromiter((len(text.encode("utf-8")) for text in texts), dtype=np.int64, count=len(texts)))
+    if not offsets[-1]:
+        np.save(path, np.zeros(0, dtype=np.uint8))
+        return offsets
+    blob = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(int(offsets[-1]),))
+    for position, text in enumerate(texts):
+        blob[offsets[position] : offsets[position + 1]] = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+    blob.flush()
+    del blob
+    return offsets
+
+
+class ChunkTexts(SequenceABC):
+    """The texts of a chunk sequence, read one chunk at a time."""
+
+    def __init__(self, chunks: Sequence[Dict[str, str]]) -> None:
+        self.chunks = chunks
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def __getitem__(self, position: int) -> str:
+        return self.chunks[position].get("text") or ""
+
+    def __iter__(self) -> Iterator[str]:
+        return ((chunk.get("text") or "") for chunk in self.chunks)
+
+
+class LazyChunks(SequenceABC):
+    """Chunk records backed by a memory-mapped text blob.
+
+    Only ids and source positions live in Python objects; a chunk's text is decoded
+    when that chunk is read, so a search materializes text for its hits alone.
+    """
+
+    def __init__(
+        self,
+        ids: List[Optional[str]],
+        sources: List[str],
+        source_ids: np.ndarray,
+        blob: np.ndarray,
+        offsets: np.ndarray,
+        aliases: Optional[Dict[int, List[str]]] = None,
+        spans: Optional[np.ndarray] = None,
+    ) -> None:
+        self.ids = ids
+        self.sources = sources
+        self.source_ids = source_ids
+        self.blob = blob
+        self.offsets = offsets
+        self.aliases = aliases or {}
+        self.spans = spans
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def text(self, position: int) -> str:
+        return self.blob[self.offsets[position] : self.offsets[position + 1]].tobytes().decode("utf-8")
+
+    def __getitem__(self, position: int) -> Dict[str, str]:
+        if not -len(self) <= position < len(self):
+            raise IndexError(position)
+        position %= len(self)
+        chunk = {
+            "id": self.ids[position],
+            "source": self.sources[self.source_ids[position]],
+            "text": self.text(position),
+        }
+        if position in self.aliases:
+            chunk["aliases"] = self.aliases[position]
+        if self.spans is not None:
+            chunk["span"] = [int(offset) for offset in self.spans[position]]
+        return chunk
+
+
+class ShardedChunks(SequenceABC):
+    """Global row view over the chunk sequences of several shards."""
+
+    def __init__(self, parts: List[Sequence[Dict[str, str]]], offsets: Sequence[int]) -> None:
+        self.parts = parts
+        self.offsets = [int(offset) for offset in offsets]
+
+    def __len__(self) -> int:
+        return self.offsets[-1]
+
+    def __getitem__(self, row: int) -> Dict[str, str]:
+        if not -len(self) <= row < len(self):
+            raise IndexError(row)
+        row %= len(self)
+        position = bisect.bisect_right(self.offsets, row) - 1
+        return self.parts[position][row - self.offsets[position]]
+
+
+def _header_files(header: Dict[str, object]) -> Dict[str, str]:
+    """Payload file names for a header; pre-generation headers use the bare names."""
+    if "files" in header:
+        return dict(header["files"])
+    files = {"embeddings": EMBEDDINGS_FILE, "chunks": CHUNKS_FILE, "lexical": LEXICAL_FILE, "ivf": ANN_FILE}
+    if header.get("dtype", "float32") != "float32":
+        files["exact"] = EXACT_EMBEDDINGS_FILE
+    if header.get("dtype") == "int8":
+        files["scales"] = SCALES_FILE
+    return files
+
+
+def write_text_atomic(path: Path, text: str) -> None:
+    """Write via a temp file and rename so readers see the old or new file, never a partial one."""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _save_normalized(path: Path, embeddings: np.ndarray) -> np.ndarray:
+    """Write L2-normalized float32 rows to a .npy file and return it memory-mapped."""
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=embeddings.shape)
+    for start in range(0, embeddings.shape[0], SCAN_BLOCK_ROWS):
+        block = np.asarray(embeddings[start : start + SCAN_BLOCK_ROWS], dtype=np.float32)
+        out[start : start + block.shape[0]] = _normalize_rows(block)
+    out.flush()
+    del out
+    return np.load(path, mmap_mode="r")
+
+
+def write_binary_index(
+    out_dir: Path,
+    model: str,
+    embeddings: np.ndarray,
+    chunks: Sequence[Dict[str, str]],
+    storage: str = "float32",
+    ann: bool = False,
+    ann_lists: Optional[int] = None,
+    provider: Optional[Dict[str, object]] = None,
+    embedder: Optional[embedding_providers.LocalProvider] = None,
+) -> str:
+    """Write normalized embeddings plus chunk metadata in the memmap-friendly layout.
+
+    The sidecar stores each source path once and refers to it by position, so the
+    metadata stays small even when a document contributes hundreds of chunks.
+    Quantized storage modes also keep a float32 copy for exact rescoring, and
+    ``ann`` adds an IVF coarse quantizer (about sqrt(N) lists unless ``ann_lists``).
+    ``provider`` describes what produced the embeddings; a local ``embedder`` is
+    saved with the index so queries can be embedded without a network call.
+
+    Payloads are written under a fresh generation and published by atomically
+    replacing the header, so running readers keep searching the previous
+    generation until they reload. Returns the new generation id.
+    """
+    if not isinstance(embeddings, np.ndarray):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.ndim != 2 or embeddings.shape[0] != len(chunks):
+        raise ValueError("Embedding matrix does not match chunk count.")
+    # One pass for the small per-chunk fields; texts are streamed from ``chunks`` (a
+    # build passes its on-disk record spool), so the corpus text is never held whole
+    metadata = [{key: chunk.get(key) for key in ("id", "source", "ordinal", "aliases", "span")} for chunk in chunks]
+    source_table, source_ids = _encode_sources(metadata)
+    alias_rows, alias_ids = _encode_aliases(metadata, source_table)
 
+    out_dir.mkdir(parents=True, exist_ok=True)
+    generation = f"{time.time_ns()}"
+    files = {
+        "embeddings": _generation_name(EMBEDDINGS_FILE, generation),
+        "chunks": _generation_name(CHUNKS_FILE, generation),
+        "texts": _generation_name(TEXTS_FILE, generation),
+        "text_offsets": _generation_name(TEXT_OFFSETS_FILE, generation),
+        "lexical": _generation_name(LEXICAL_FILE, generation),
+    }
+    if storage != "float32":
+        files["exact"] = _generation_name(EXACT_EMBEDDINGS_FILE, generation)
+    # Normalized float32 rows go straight to disk block by block, so a memory-mapped
+    # input (a build spool) is never materialized in full
+    vectors = _save_normalized(out_dir / files.get("exact", files["embeddings"]), embeddings)
+    quantized = quantize_rows(vectors, storage)
+    if storage != "float32":
+        np.save(out_dir / files["embeddings"], quantized["embeddings"])
+    if "scales" in quantized:
+        files["scales"] = _generation_name(SCALES_FILE, generation)
+        np.save(out_dir / files["scales"], quantized["scales"])
+    sidecar = {
+        "sources": source_table,
+        "source_ids": source_ids,
+        "ids": [chunk["id"] for chunk in metadata],
+        "ordinals": _chunk_ordinals(metadata, np.asarray(source_ids, dtype=np.int32)).tolist(),
+        # Near-duplicate chunks collapsed at build time keep every other source here
+        "alias_rows": alias_rows,
+        "alias_ids": alias_ids,
+    }
+    spans = [chunk["span"] for chunk in metadata]
+    if all(spans):
+        # [start, end) character range of each chunk in its (canonical) source text
+        sidecar["spans"] = spans
+    (out_dir / files["chunks"]).write_text(json.dumps(sidecar, separators=(",", ":")), encoding="utf-8")
+    texts = ChunkTexts(chunks)
+    np.save(out_dir / files["text_offsets"], save_texts(out_dir / files["texts"], texts))
+    lexical_index.save_lexical_index(lexical_index.build_lexical_index(texts), out_dir / files["lexical"])
+    if ann:
+        files["ivf"] = _generation_name(ANN_FILE, generation)
+        ann_index.save_ivf(ann_index.build_ivf(vectors, ann_lists), out_dir / files["ivf"])
+    if embedder is not None:
+        files["embedder"] = _generation_name(EMBEDDER_FILE, generation)
+        embedder.save(out_dir / files["embedder"])
+
+    try:
+        previous = read_binary_header(out_dir)
+    except (OSError, ValueError):
+        previous = None
+
+    header = {
+        "format": BINARY_FORMAT,
+        "version": BINARY_FORMAT_VERSION,
+        "generation": generation,
+        "model": model,
+        "provider": provider or (embedder.describe() if embedder else {"name": "openai", "model": model}),
+        "dim": int(vectors.shape[1]),
+        "count": int(vectors.shape[0]),
+        "dtype": storage,
+        "normalized": True,
+        "files": files,
+    }
+    # Header goes last so a reader never sees it before the payload is complete
+    write_text_atomic(out_dir / HEADER_FILE, json.dumps(header, indent=2))
+    # A single index replaces any sharded layout that was published here before
+    (out_dir / SHARD_MANIFEST_FILE).unlink(missing_ok=True)
+    shutil.rmtree(out_dir / SHARDS_DIR, ignore_errors=True)
+    _prune_generations(out_dir, [header] + ([previous] if previous else []))
+    return generation
+
+
+def _prune_generations(out_dir: Path, keep_headers: Sequence[Dict[str, object]]) -> None:
+    """Delete payloads not referenced by the current or previous header.
+
+    The previous generation survives one more build so a reader that read the old
+    header just before the swap can still open its files. Readers that already
+    memory-mapped a deleted file keep a valid mapping.
+    """
+    keep = {HEADER_FILE}
+    for header in keep_headers:
+        keep.update(_header_files(header).values())
+    for path in out_dir.iterdir():
+        if path.is_file() and path.name not in keep and not path.name.startswith("."):
+            path.unlink()
+
+
+def read_binary_header(index_dir: Path = BINARY_INDEX_DIR) -> Dict[str, object]:
+    header = json.loads((index_dir / HEADER_FILE).read_text(encoding="utf-8"))
+    if header.get("format") != BINARY_FORMAT:
+        raise ValueError(f"{index_dir} is not a {BINARY_FORMAT} directory.")
+    if header.get("version") not in SUPPORTED_FORMAT_VERSIONS:
+        raise ValueError(f"Unsupported corpus index version: {header.get('version')}")
+    return header
+
+
+def shard_names(sources: Sequence[str], shard_by: str) -> List[str]:
+    """Shard for each source path: its collection, or the directory it sits in."""
+    if shard_by not in SHARD_KEYS:
+        raise ValueError(f"Unknown shard key {shard_by!r}; use one of {SHARD_KEYS}.")
+    if shard_by == "collection":
+        keys = [str(meta["collection"]) for meta in _source_metadata(sources)]
+    else:
+        keys = [Path(source).parent.name for source in sources]
+    return [re.sub(r"[^A-Za-z0-9_.-]+", "_", key).strip("._") or "default" for key in keys]
+
+
+def read_shard_manifest(index_dir: Path = BINARY_INDEX_DIR) -> Optional[Dict[str, object]]:
+    """The shard manifest, or None when ``index_dir`` holds a single index (or nothing)."""
+    path = index_dir / SHARD_MANIFEST_FILE
+    if not path.exists():
+        return None
+    manifest = json.loads(path.read_text(encoding="utf-8"))
+    if manifest.get("format") != SHARD_FORMAT:
+        raise ValueError(f"{path} is not a {SHARD_FORMAT} manifest.")
+    return manifest
+
+
+def write_shard_manifest(
+    index_dir: Path,
+    shards: Sequence[str],
+    provider: Dict[str, object],
+    embedder: Optional[embedding_providers.LocalProvider] = None,
+) -> str:
+    """Publish the shard list (each already written under SHARDS_DIR/<name>) atomically.
+
+    A local ``embedder`` is stored once for all shards; when omitted, the previous
+    manifest's embedder is kept. Shard directories no longer listed, and files of a
+    single index previously published here, are removed. Returns the manifest generation.
+    """
+    try:
+        previous = read_shard_manifest(index_dir)
+    except (OSError, ValueError):
+        previous = None
+    generation = f"{time.time_ns()}"
+    manifest: Dict[str, object] = {
+        "format": SHARD_FORMAT,
+        "version": 1,
+        "generation": generation,
+        "provider": provider,
+        "shards": sorted(set(shards)),
+    }
+    if embedder is not None:
+        manifest["embedder"] = _generation_name(EMBEDDER_FILE, generation)
+        embedder.save(index_dir / manifest["embedder"])
+    elif previous and previous.get("embedder"):
+        manifest["embedder"] = previous["embedder"]
+    write_text_atomic(index_dir / SHARD_MANIFEST_FILE, json.dumps(manifest, indent=2))
+
+    keep = {SHARD_MANIFEST_FILE, manifest.get("embedder"), (previous or {}).get("embedder")}
+    for path in index_dir.iterdir():
+        if path.is_file() and path.name not in keep and not path.name.startswith("."):
+            path.unlink()
+    for path in (index_dir / SHARDS_DIR).iterdir():
+        if path.is_dir() and path.name not in manifest["shards"]:
+            shutil.rmtree(path, ignore_errors=True)
+    return generation
+
+
+def _load_binary_index(index_dir: Path) -> Dict[str, np.ndarray]:
+    header = read_binary_header(index_dir)
+    if not header["count"]:
+        return _empty_index()
+    files = _header_files(header)
+
+    # Read-only memmap: pages load on demand and are shared between processes
+    storage = header.get("dtype", "float32")
+    embeddings = np.load(index_dir / files["embeddings"], mmap_mode="r")
+    if embeddings.shape != (header["count"], header["dim"]):
+        raise ValueError(
+            f"Corpus index header expects {header['count']}x{header['dim']}, "
+            f"found {embeddings.shape[0]}x{embeddings.shape[1]}."
+        )
+    if embeddings.dtype != np.dtype(storage):
+        raise ValueError(f"Corpus index header says {storage}, found {embeddings.dtype}.")
+
+    sidecar = json.loads((index_dir / files["chunks"]).read_text(encoding="utf-8"))
+    sources = sidecar["sources"]
+    source_ids = np.asarray(sidecar["source_ids"], dtype=np.int32)
+    alias_rows = np.asarray(sidecar.get("alias_rows", []), dtype=np.int64)
+    alias_ids = np.asarray(sidecar.get("alias_ids", []), dtype=np.int32)
+    if "texts" in files:
+        blob = np.load(index_dir / files["texts"], mmap_mode="r")
+        offsets = np.load(index_dir / files["text_offsets"])
+        if len(offsets) != header["count"] + 1 or offsets[-1] != blob.shape[0]:
+            raise ValueError("Corpus index text offsets do not match the text blob.")
+        spans = np.asarray(sidecar["spans"], dtype=np.int64) if "spans" in sidecar else None
+        chunks = LazyChunks(
+            sidecar["ids"], sources, source_ids, blob, offsets, _alias_map(sources, alias_rows, alias_ids), spans
+        )
+    else:
+        chunks = [
+            {"id": chunk_id, "source": sources[source_id], "text": text}
+            for chunk_id, source_id, text in zip(sidecar["ids"], sidecar["source_ids"], sidecar["texts"])
+        ]
+    data = {
+        "embeddings": embeddings,
+        "chunks": chunks,
+        "storage": storage,
+        "sources": sources,
+        "source_ids": source_ids,
+        "ordinals": (
+            np.asarray(sidecar["ordinals"], dtype=np.int32)
+            if "ordinals" in sidecar
+            else _ordinals_by_position(source_ids)
+        ),
+        "alias_rows": alias_rows,
+        "alias_ids": alias_ids,
+        "generation": header.get("generation"),
+        "provider": header.get("provider") or {"name": "openai", "model": header.get("model")},
+    }
+    if storage != "float32":
+        data["exact"] = np.load(index_dir / files["exact"], mmap_mode="r")
+    if storage == "int8":
+        data["scales"] = np.load(index_dir / files["scales"])
+    if (index_dir / files.get("lexical", LEXICAL_FILE)).exists():
+        data["lexical"] = lexical_index.load_lexical_index(index_dir / files["lexical"])
+    if "ivf" in files and (index_dir / files["ivf"]).exists():
+        data["ivf"] = ann_index.load_ivf(index_dir / files["ivf"])
+    if "embedder" in files:
+        data["embedder"] = embedding_providers.LocalProvider.load(index_dir / files["embedder"])
+    return data
+
+
+def _read_jsonl_index(path: Path) -> Dict[str, object]:
+    """Parse the legacy JSONL index into raw (unnormalized) vectors and chunk metadata."""
     embeddings: List[List[float]] = []
     chunks: List[Dict[str, str]] = []
+    model = None
 
-    with INDEX_PATH.open("r", encoding="utf-8") as f:
+    with path.open("r", encoding="utf-8") as f:
         for line in f:
             record = json.loads(line)
             chunks.append(
@@ -32,53 +599,980 @@ def _load_index() -> Dict[str, np.ndarray]:
                     "id": record.get("id"),
                     "source": record.get("source"),
                     "text": record.get("text"),
+                    "ordinal": record.get("ordinal"),
+                    "aliases": record.get("aliases"),
+                    "span": record.get("span"),
                 }
             )
             embeddings.append(record["embedding"])
+            model = model or record.get("model")
 
-    if not embeddings:
-        return {"embeddings": np.zeros((0, 0)), "chunks": []}
+    vectors = np.array(embeddings, dtype=np.float32) if embeddings else np.zeros((0, 0), dtype=np.float32)
+    return {"embeddings": vectors, "chunks": chunks, "model": model}
 
-    vectors = np.array(embeddings, dtype=np.float32)
-    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
-    norms[norms == 0] = 1
-    normalized = vectors / norms
-    return {"embeddings": normalized, "chunks": chunks}
 
+def convert_jsonl_index(
+    jsonl_path: Path = INDEX_PATH,
+    out_dir: Path = BINARY_INDEX_DIR,
+    storage: str = "float32",
+    ann: bool = False,
+    ann_lists: Optional[int] = None,
+    dimensions: Optional[int] = None,
+) -> int:
+    """Convert an existing JSONL index into the binary layout. Returns the chunk count.
+
+    ``dimensions`` stores a truncated, renormalized copy without re-embedding.
+    """
+    parsed = _read_jsonl_index(jsonl_path)
+    if not parsed["chunks"]:
+        raise ValueError(f"No records found in {jsonl_path}.")
+    write_binary_index(
+        out_dir,
+        parsed["model"] or "unknown",
+        truncate_rows(_normalize_rows(parsed["embeddings"]), dimensions),
+        parsed["chunks"],
+        storage=storage,
+        ann=ann,
+        ann_lists=ann_lists,
+    )
+    return len(parsed["chunks"])
+
+
+def _derive_source_metadata(source: str) -> Dict[str, object]:
+    """Collection, title and year guessed from a path like data/vonnegut_corpus/public_domain/2BR02B.txt."""
+    path = Path(source)
+    parts = path.parts
+    if "vonnegut_corpus" in parts[:-2]:
+        collection = parts[parts.index("vonnegut_corpus") + 1]
+    elif "data" in parts[:-2]:
+        collection = parts[parts.index("data") + 1]
+    else:
+        collection = path.parent.name
+
+    stem = re.sub(r"^pg_", "", path.stem)
+    words = re.sub(r"(?<=[a-z])(?=[A-Z])", " ", stem).replace("_", " ").split()
+    year = YEAR_PATTERN.search(stem)
+    return {
+        "collection": collection,
+        "title": " ".join(word.capitalize() for word in words if not YEAR_PATTERN.fullmatch(word)),
+        "year": int(year.group(1)) if year else None,
+    }
+
+
+def read_source_metadata() -> Dict[str, Dict[str, object]]:
+    """Metadata overrides from data/corpus_sources.json, keyed by source path."""
+    if not SOURCE_METADATA_PATH.exists():
+        return {}
+    return json.loads(SOURCE_METADATA_PATH.read_text(encoding="utf-8"))
+
+
+def _source_metadata(sources: Sequence[str]) -> List[Dict[str, object]]:
+    """Per-source metadata: derived from the path, overridden by data/corpus_sources.json."""
+    overrides = read_source_metadata()
+    return [{**_derive_source_metadata(source), **overrides.get(source, {})} for source in sources]
+
+
+def _load_sharded_index(
+    index_dir: Path,
+    manifest: Dict[str, object],
+    previous: Optional[Dict[str, np.ndarray]] = None,
+) -> Dict[str, np.ndarray]:
+    """Load every shard, reusing the loaded copy of any shard whose generation is unchanged."""
+    loaded = {shard["name"]: shard for shard in (previous or {}).get("shards", [])}
+    shards = []
+    for name in manifest["shards"]:
+        shard_dir = index_dir / SHARDS_DIR / name
+        generation = read_binary_header(shard_dir).get("generation")
+        shard = loaded.get(name)
+        if shard is None or shard.get("generation") != generation:
+            shard = _load_binary_index(shard_dir)
+            if LOAD_DIMENSIONS:
+                _truncate_index(shard, LOAD_DIMENSIONS)
+            shard["name"] = name
+        if len(shard["source_ids"]):
+            shards.append(shard)
+    if not shards:
+        return _empty_index()
+
+    offsets = np.zeros(len(shards) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(shard["source_ids"]) for shard in shards])
+    positions: Dict[str, int] = {}
+    source_ids = []
+    alias_rows = []
+    alias_ids = []
+    for shard, offset in zip(shards, offsets):
+        table = np.array([positions.setdefault(source, len(positions)) for source in shard["sources"]], dtype=np.int32)
+        source_ids.append(table[shard["source_ids"]])
+        shard_rows, shard_ids = _alias_pairs(shard)
+        alias_rows.append(shard_rows + offset)
+        alias_ids.append(table[shard_ids])
+    data = {
+        "shards": shards,
+        "shard_offsets": offsets,
+        "chunks": ShardedChunks([shard["chunks"] for shard in shards], offsets),
+        "sources": list(positions),
+        "source_ids": np.concatenate(source_ids),
+        "ordinals": np.concatenate([shard["ordinals"] for shard in shards]),
+        "alias_rows": np.concatenate(alias_rows),
+        "alias_ids": np.concatenate(alias_ids),
+        "generation": "+".join(f"{shard['name']}:{shard.get('generation')}" for shard in shards),
+        "provider": manifest.get("provider") or shards[0].get("provider"),
+    }
+    if manifest.get("embedder"):
+        embedder = embedding_providers.LocalProvider.load(index_dir / manifest["embedder"])
+        data["embedder"] = embedder.truncated(LOAD_DIMENSIONS) if LOAD_DIMENSIONS else embedder
+    return data
+
+
+def _read_index(previous: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, np.ndarray]:
+    manifest = read_shard_manifest(BINARY_INDEX_DIR)
+    if manifest is not None:
+        data = _load_sharded_index(BINARY_INDEX_DIR, manifest, previous)
+    elif (BINARY_INDEX_DIR / HEADER_FILE).exists():
+        data = _load_binary_index(BINARY_INDEX_DIR)
+    elif not INDEX_PATH.exists():
+        data = _empty_index()
+    else:
+        parsed = _read_jsonl_index(INDEX_PATH)
+        if not parsed["chunks"]:
+            data = _empty_index()
+        else:
+            source_table, source_ids = _encode_sources(parsed["chunks"])
+            alias_rows, alias_ids = _encode_aliases(parsed["chunks"], source_table)
+            data = {
+                "embeddings": _normalize_rows(parsed["embeddings"]),
+                "chunks": parsed["chunks"],
+                "sources": source_table,
+                "source_ids": np.asarray(source_ids, dtype=np.int32),
+                "ordinals": _chunk_ordinals(parsed["chunks"], np.asarray(source_ids, dtype=np.int32)),
+                "alias_rows": np.asarray(alias_rows, dtype=np.int64),
+                "alias_ids": np.asarray(alias_ids, dtype=np.int32),
+            }
+    if LOAD_DIMENSIONS and "shards" not in data:
+        _truncate_index(data, LOAD_DIMENSIONS)
+    data["source_meta"] = _source_metadata(data["sources"])
+    data["mask_cache"] = {}
+    return data
+
+
+def _truncate_index(data: Dict[str, np.ndarray], dimensions: int) -> None:
+    """Narrow a loaded index in place. This copies the matrix out of the memmap."""
+    if data["embeddings"].size == 0 or data["embeddings"].shape[1] <= dimensions:
+        return
+    exact = truncate_rows(np.asarray(data.get("exact", data["embeddings"]), dtype=np.float32), dimensions)
+    storage = data.get("storage", "float32")
+    data.pop("exact", None)
+    data.pop("scales", None)
+    data.update(quantize_rows(exact, storage))
+    if storage != "float32":
+        data["exact"] = exact
+    if "ivf" in data:
+        data["ivf"] = {**data["ivf"], "centroids": truncate_rows(data["ivf"]["centroids"], dimensions)}
+    if "embedder" in data:
+        data["embedder"] = data["embedder"].truncated(dimensions)
+
+
+def _index_width(data: Dict[str, np.ndarray]) -> int:
+    if "shards" in data:
+        return max(_index_width(shard) for shard in data["shards"])
+    return int(data["embeddings"].shape[1]) if data["embeddings"].size else 0
+
+
+def index_dimensions() -> int:
+    """Width of the loaded index (0 when no index is available)."""
+    return _index_width(_load_index())
+
+
+def index_provider() -> Dict[str, object]:
+    """Which embedding provider built the loaded index ({"name": ..., "model": ...})."""
+    return dict(_load_index().get("provider") or {})
+
+
+def query_embedder() -> Optional[embedding_providers.LocalProvider]:
+    """The local embedding model stored with the index, or None if queries need the API."""
+    return _load_index().get("embedder")
+
+
+def _prepare_queries(data: Dict[str, np.ndarray], queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Truncate queries to the index width, L2-normalize them and flag zero rows."""
+    width = _index_width(data)
+    if queries.shape[1] > width:
+        queries = queries[:, :width]
+    q_norms = np.linalg.norm(queries, axis=1)
+    valid = q_norms > 0
+    return queries / np.where(valid, q_norms, 1)[:, None], valid
+
+
+def _stat_identity(path: Path) -> Optional[Tuple]:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return (str(path), stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def _index_fingerprint() -> Tuple:
+    """Cheap stat-based identity of the on-disk index; changes on every publish.
+
+    A sharded index also includes every shard header, so rebuilding one shard counts.
+    """
+    manifest_path = BINARY_INDEX_DIR / SHARD_MANIFEST_FILE
+    if manifest_path.exists():
+        try:
+            names = read_shard_manifest(BINARY_INDEX_DIR)["shards"]
+        except (OSError, ValueError, TypeError):
+            names = []
+        paths = [manifest_path] + [BINARY_INDEX_DIR / SHARDS_DIR / name / HEADER_FILE for name in names]
+        return tuple(_stat_identity(path) for path in paths)
+    for path in (BINARY_INDEX_DIR / HEADER_FILE, INDEX_PATH):
+        identity = _stat_identity(path)
+        if identity is not None:
+            return identity
+    return ()
 
-def search_by_embedding(query_embedding: List[float], top_k: int = 3) -> List[Dict[str, str]]:
+
+# The live index. Searches grab a reference to the dict and never see it mutate
+# into another generation; reloads build a new dict and swap the reference.
+_state: Dict[str, object] = {"data": None, "fingerprint": None, "checked": 0.0}
+_reload_lock = threading.Lock()
+
+
+def _load_index() -> Dict[str, np.ndarray]:
+    data = _state["data"]
+    now = time.monotonic()
+    if data is not None and now - _state["checked"] < RELOAD_CHECK_SECONDS:
+        return data
+
+    fingerprint = _index_fingerprint()
+    if data is not None and fingerprint == _state["fingerprint"]:
+        _state["checked"] = now
+        return data
+
+    # Only one thread reloads; the rest keep serving the current generation meanwhile
+    if data is not None and not _reload_lock.acquire(blocking=False):
+        return data
+    if data is None:
+        _reload_lock.acquire()
+    try:
+        if _state["data"] is not None and _state["fingerprint"] == fingerprint:
+            return _state["data"]
+        try:
+            fresh = _read_index(_state["data"])
+        except (OSError, ValueError):
+            # A publish raced the read (e.g. payload pruned); retry once with the new header
+            fingerprint = _index_fingerprint()
+            try:
+                fresh = _read_index(_state["data"])
+            except (OSError, ValueError):
+                if _state["data"] is None:
+                    raise
+                # Keep serving the generation we have rather than failing searches
+                _state["checked"] = time.monotonic()
+                return _state["data"]
+        _state.update(data=fresh, fingerprint=fingerprint, checked=time.monotonic())
+        return fresh
+    finally:
+        _reload_lock.release()
+
+
+def preload_index() -> Dict[str, np.ndarray]:
+    """Load the index in a pre-fork server process so every worker shares one copy.
+
+    Forked workers inherit the arrays and chunk objects copy-on-write. Freezing the
+    garbage collector keeps collections in the workers from writing to (and so
+    copying) the pages those objects live on.
+    """
+    data = _load_index()
+    gc.freeze()
+    return data
+
+
+def index_version() -> str:
+    """Identity of the loaded index generation, for keying caches of search results."""
     data = _load_index()
+    return str(data.get("generation") or _state["fingerprint"])
+
+
+def _scan_scores(data: Dict[str, np.ndarray], queries: np.ndarray) -> np.ndarray:
+    """Score a (queries x dim) matrix against every row; exact for float32, approximate when quantized."""
     embeddings = data["embeddings"]
-    chunks = data["chunks"]
+    if data.get("storage", "float32") == "float32":
+        return queries @ embeddings.T
 
-    if embeddings.size == 0:
-        return []
+    # Upcast block by block so a batch never materializes a full float32 matrix
+    scores = np.empty((queries.shape[0], embeddings.shape[0]), dtype=np.float32)
+    for start in range(0, embeddings.shape[0], SCAN_BLOCK_ROWS):
+        block = np.asarray(embeddings[start : start + SCAN_BLOCK_ROWS], dtype=np.float32)
+        scores[:, start : start + block.shape[0]] = queries @ block.T
+    if "scales" in data:
+        scores *= data["scales"]
+    return scores
+
+
+def _top_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Per-row top-k column indices of a 2-D score matrix, best first."""
+    if top_k >= scores.shape[1]:
+        return np.argsort(-scores, axis=1)
+    top_indices = np.argpartition(scores, -top_k, axis=1)[:, -top_k:]
+    order = np.argsort(-np.take_along_axis(scores, top_indices, axis=1), axis=1)
+    return np.take_along_axis(top_indices, order, axis=1)
+
+
+def _alias_pairs(data: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """(row, source id) per alias source; empty for indexes built before aliases."""
+    return (
+        data.get("alias_rows", np.zeros(0, dtype=np.int64)),
+        data.get("alias_ids", np.zeros(0, dtype=np.int32)),
+    )
+
+
+def _source_masks(
+    data: Dict[str, np.ndarray],
+    source_filter: Sequence[Optional[Sequence[str]]],
+) -> Optional[np.ndarray]:
+    """Boolean (queries x chunks) mask of rows each query may return; None when unfiltered."""
+    if not any(allowed is not None for allowed in source_filter):
+        return None
+    positions = {source: pos for pos, source in enumerate(data["sources"])}
+    allowed_table = np.ones((len(source_filter), len(data["sources"])), dtype=bool)
+    for row, allowed in enumerate(source_filter):
+        if allowed is None:
+            continue
+        allowed_table[row] = False
+        allowed_table[row, [positions[src] for src in allowed if src in positions]] = True
+    masks = allowed_table[:, data["source_ids"]]
+    alias_rows, alias_ids = _alias_pairs(data)
+    if alias_rows.size:
+        np.logical_or.at(masks, (slice(None), alias_rows), allowed_table[:, alias_ids])
+    return masks
+
+
+def _search_ivf(
+    data: Dict[str, np.ndarray],
+    queries: np.ndarray,
+    top_k: int,
+    nprobe: int,
+    masks: Optional[np.ndarray] = None,
+    bonus: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact float32 scoring restricted to the rows of each query's probed IVF lists."""
+    matrix = data.get("exact", data["embeddings"])
+    probed = ann_index.probe_lists(data["ivf"], queries, nprobe)
+    top_indices = np.full((queries.shape[0], top_k), -1, dtype=np.int64)
+    top_scores = np.full((queries.shape[0], top_k), -np.inf, dtype=np.float32)
+
+    for row, query_vec in enumerate(queries):
+        candidates = ann_index.list_members(data["ivf"], probed[row])
+        if masks is not None:
+            candidates = candidates[masks[row, candidates]]
+        if candidates.size == 0:
+            continue
+        scores = np.asarray(matrix[candidates], dtype=np.float32) @ query_vec
+        if bonus is not None:
+            scores = scores + bonus[candidates]
+        order = _top_indices(scores[None, :], top_k)[0]
+        top_indices[row, : order.size] = candidates[order]
+        top_scores[row, : order.size] = scores[order]
+    return top_indices, top_scores
+
+
+def _as_list(value: object) -> List[object]:
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def _source_matches(source: str, meta: Dict[str, object], filters: Dict[str, object]) -> bool:
+    if filters.get("source") is not None:
+        if not any(fnmatch.fnmatch(source, pattern) for pattern in _as_list(filters["source"])):
+            return False
+    if filters.get("collection") is not None:
+        if meta.get("collection") not in _as_list(filters["collection"]):
+            return False
+    if filters.get("title") is not None:
+        wanted = {str(title).casefold() for title in _as_list(filters["title"])}
+        if str(meta.get("title") or "").casefold() not in wanted:
+            return False
+    if filters.get("year") is not None:
+        year = meta.get("year")
+        bounds = _as_list(filters["year"])
+        start, end = (bounds[0], bounds[-1])
+        if year is None or not (start is None or year >= start) or not (end is None or year <= end):
+            return False
+    return True
 
-    query_vec = np.array(query_embedding, dtype=np.float32)
-    q_norm = np.linalg.norm(query_vec)
-    if q_norm == 0:
-        return []
-    query_vec = query_vec / q_norm
 
-    scores = embeddings @ query_vec
-    if top_k >= len(chunks):
-        top_indices = np.argsort(scores)[::-1]
+def _filter_mask(data: Dict[str, np.ndarray], filters: Optional[Dict[str, object]]) -> Optional[np.ndarray]:
+    """Boolean row mask for a metadata filter; evaluated once per source, cached per filter."""
+    if not filters:
+        return None
+    key = json.dumps(filters, sort_keys=True, default=list)
+    cache = data["mask_cache"]
+    mask = cache.get(key)
+    if mask is None:
+        allowed = np.array(
+            [_source_matches(source, meta, filters) for source, meta in zip(data["sources"], data["source_meta"])],
+            dtype=bool,
+        )
+        mask = allowed[data["source_ids"]] if allowed.size else np.zeros(0, dtype=bool)
+        alias_rows, alias_ids = _alias_pairs(data)
+        if alias_rows.size:
+            # A collapsed chunk matches when any of its sources does
+            mask[alias_rows[allowed[alias_ids]]] = True
+        if len(cache) >= MASK_CACHE_SIZE:
+            cache.clear()
+        cache[key] = mask
+    return mask
+
+
+def _combine_masks(
+    data: Dict[str, np.ndarray],
+    rows: int,
+    source_filter: Optional[Sequence[Optional[Sequence[str]]]],
+    filters: Optional[Dict[str, object]],
+) -> Optional[np.ndarray]:
+    masks = _source_masks(data, source_filter) if source_filter is not None else None
+    filter_mask = _filter_mask(data, filters)
+    if filter_mask is None:
+        return masks
+    if masks is None:
+        return np.broadcast_to(filter_mask, (rows, filter_mask.size))
+    return masks & filter_mask
+
+
+def _boost_bonus(
+    data: Dict[str, np.ndarray],
+    boost: Optional[Dict[str, object]],
+    boost_weight: float,
+) -> Optional[np.ndarray]:
+    """Additive score bonus for rows matching ``boost`` (e.g. the work the reader has open)."""
+    boost_mask = _filter_mask(data, boost)
+    if boost_mask is None or not boost_weight:
+        return None
+    return boost_mask.astype(np.float32) * np.float32(boost_weight)
+
+
+def _search_index(
+    data: Dict[str, np.ndarray],
+    queries: np.ndarray,
+    top_k: int,
+    rescore_factor: int = DEFAULT_RESCORE_FACTOR,
+    masks: Optional[np.ndarray] = None,
+    nprobe: int = ann_index.DEFAULT_NPROBE,
+    bonus: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return (row indices, scores), each (queries x k), for normalized queries, best first.
+
+    Rows excluded by ``masks`` (or missed by the IVF probe) score -inf; callers drop them.
+    ``bonus`` is a per-row additive boost. ``nprobe=0`` forces the exact scan even
+    when an IVF index is loaded.
+    """
+    if "shards" in data:
+        return _search_shards(data, queries, top_k, rescore_factor, masks, nprobe, bonus)
+    if "ivf" in data and nprobe > 0:
+        return _search_ivf(data, queries, top_k, nprobe, masks, bonus)
+
+    scores = _scan_scores(data, queries)
+    if bonus is not None:
+        scores += bonus
+    if masks is not None:
+        scores = np.where(masks, scores, -np.inf)
+    if "exact" not in data or rescore_factor <= 0:
+        top_indices = _top_indices(scores, top_k)
+        return top_indices, np.take_along_axis(scores, top_indices, axis=1)
+
+    # Quantized first pass, then exact float32 rescoring of each row's shortlist
+    candidates = np.sort(_top_indices(scores, top_k * max(1, rescore_factor)), axis=1)
+    shortlist = np.asarray(data["exact"][candidates.ravel()], dtype=np.float32)
+    shortlist = shortlist.reshape(candidates.shape + (-1,))
+    exact_scores = np.einsum("qcd,qd->qc", shortlist, queries)
+    if bonus is not None:
+        exact_scores += bonus[candidates]
+    if masks is not None:
+        exact_scores = np.where(np.take_along_axis(masks, candidates, axis=1), exact_scores, -np.inf)
+    order = _top_indices(exact_scores, top_k)
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(exact_scores, order, axis=1)
+
+
+_shard_pool: Optional[ThreadPoolExecutor] = None
+_shard_pool_lock = threading.Lock()
+
+
+def _shard_executor() -> ThreadPoolExecutor:
+    global _shard_pool
+    with _shard_pool_lock:
+        if _shard_pool is None:
+            _shard_pool = ThreadPoolExecutor(max_workers=SHARD_SEARCH_THREADS, thread_name_prefix="corpus-shard")
+        return _shard_pool
+
+
+def _search_shards(
+    data: Dict[str, np.ndarray],
+    queries: np.ndarray,
+    top_k: int,
+    rescore_factor: int,
+    masks: Optional[np.ndarray],
+    nprobe: int,
+    bonus: Optional[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Search each shard on the thread pool, then heap-merge the per-shard top-k into global rows."""
+    offsets = data["shard_offsets"]
+
+    def search(position: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, stop = offsets[position], offsets[position + 1]
+        indices, scores = _search_index(
+            data["shards"][position],
+            queries,
+            top_k,
+            rescore_factor,
+            None if masks is None else masks[:, start:stop],
+            nprobe,
+            None if bonus is None else bonus[start:stop],
+        )
+        return np.where(indices >= 0, indices + start, -1), scores
+
+    if len(data["shards"]) == 1 or SHARD_SEARCH_THREADS == 1:
+        ranked = [search(position) for position in range(len(data["shards"]))]
     else:
-        top_indices = np.argpartition(scores, -top_k)[-top_k:]
-        top_indices = top_indices[np.argsort(scores[top_indices])[::-1]]
+        ranked = list(_shard_executor().map(search, range(len(data["shards"]))))
+
+    top_indices = np.full((queries.shape[0], top_k), -1, dtype=np.int64)
+    top_scores = np.full((queries.shape[0], top_k), -np.inf, dtype=np.float32)
+    for row in range(queries.shape[0]):
+        # Each shard's list is already best-first, so a k-way heap merge suffices
+        streams = [zip(scores[row].tolist(), indices[row].tolist()) for indices, scores in ranked]
+        merged = list(itertools.islice(heapq.merge(*streams, key=lambda item: item[0], reverse=True), top_k))
+        if merged:
+            top_scores[row, : len(merged)] = [score for score, _ in merged]
+            top_indices[row, : len(merged)] = [idx for _, idx in merged]
+    return top_indices, top_scores
+
+
+def _row_vectors(data: Dict[str, np.ndarray], rows: np.ndarray) -> np.ndarray:
+    """Exact float32 vectors for global row ids."""
+    rows = np.asarray(rows, dtype=np.int64)
+    if "shards" not in data:
+        return np.asarray(data.get("exact", data["embeddings"])[rows], dtype=np.float32)
+    offsets = data["shard_offsets"]
+    shard_of = np.searchsorted(offsets, rows, side="right") - 1
+    vectors = np.empty((len(rows), _index_width(data)), dtype=np.float32)
+    for position in np.unique(shard_of):
+        picked = shard_of == position
+        vectors[picked] = _row_vectors(data["shards"][position], rows[picked] - offsets[position])
+    return vectors
+
+
+def _diversify(
+    data: Dict[str, np.ndarray],
+    rows: np.ndarray,
+    relevance: np.ndarray,
+    top_k: int,
+    mmr_lambda: Optional[float],
+    max_per_source: Optional[int],
+) -> np.ndarray:
+    """Positions into ``rows`` chosen by MMR and/or a per-source cap, in pick order.
+
+    The candidate-candidate similarity matrix is one small GEMM; each greedy step
+    is a vectorized argmax over the pool.
+    """
+    pool = len(rows)
+    if pool == 0:
+        return np.zeros(0, dtype=np.int64)
+    if mmr_lambda is not None:
+        vectors = _row_vectors(data, rows)
+        similarity = vectors @ vectors.T
+        max_similarity = np.full(pool, -np.inf, dtype=np.float32)
+    source_ids = data["source_ids"][np.asarray(rows)]
+    per_source: Dict[int, int] = {}
+    available = np.ones(pool, dtype=bool)
+    picked: List[int] = []
+
+    while len(picked) < top_k and available.any():
+        if mmr_lambda is None or not picked:
+            objective = relevance.astype(np.float32)
+        else:
+            objective = mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+        best = int(np.argmax(np.where(available, objective, -np.inf)))
+        picked.append(best)
+        available[best] = False
+        if mmr_lambda is not None:
+            np.maximum(max_similarity, similarity[:, best], out=max_similarity)
+        if max_per_source:
+            source = int(source_ids[best])
+            per_source[source] = per_source.get(source, 0) + 1
+            if per_source[source] >= max_per_source:
+                available &= source_ids != source
+    return np.asarray(picked, dtype=np.int64)
+
+
+def trim_excerpt(text: str, max_chars: int = REFERENCE_SNIPPET_CHARS) -> str:
+    """``text`` stripped and, when longer than ``max_chars``, cut at a word boundary with "..."."""
+    text = text.strip()
+    if len(text) > max_chars:
+        text = text[:max_chars].rsplit(" ", 1)[0] + "..."
+    return text
+
+
+def _format_result(chunk: Dict[str, str], score: float) -> Dict[str, str]:
+    result = {
+        "score": float(score),
+        "source": chunk["source"],
+        "text": chunk["text"],
+    }
+    if chunk.get("aliases"):
+        result["aliases"] = list(chunk["aliases"])
+    if chunk.get("span"):
+        # Character range of the matched chunk in ``source``, for citing and highlighting
+        result["start"], result["end"] = chunk["span"]
+    return result
 
+
+def _neighbour_links(data: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """(previous row, next row) per row, -1 at document edges; built once per loaded index."""
+    links = data.get("neighbours")
+    if links is None:
+        source_ids, ordinals = data["source_ids"], data["ordinals"]
+        order = np.lexsort((ordinals, source_ids))
+        adjacent = (source_ids[order][1:] == source_ids[order][:-1]) & (ordinals[order][1:] == ordinals[order][:-1] + 1)
+        previous = np.full(len(order), -1, dtype=np.int64)
+        following = np.full(len(order), -1, dtype=np.int64)
+        following[order[:-1][adjacent]] = order[1:][adjacent]
+        previous[order[1:][adjacent]] = order[:-1][adjacent]
+        links = data["neighbours"] = (previous, following)
+    return links
+
+
+def _merge_words(left: List[str], right: List[str]) -> List[str]:
+    """Concatenate, dropping the longest prefix of ``right`` that repeats the end of ``left``."""
+    if right:
+        for size in range(min(len(left), len(right), MAX_OVERLAP_WORDS), 0, -1):
+            if left[-size] == right[0] and left[-size:] == right[:size]:
+                return left + right[size:]
+    return left + right
+
+
+def _expand_hit(
+    data: Dict[str, np.ndarray],
+    row: int,
+    budget: int,
+    used: set,
+    shown: Dict[int, int],
+) -> Tuple[str, int, int, Optional[Tuple[int, int]]]:
+    """Grow a hit into whole neighbouring chunks while the merged text fits ``budget`` words.
+
+    Chunks in ``used`` were fully shown for a better-ranked hit and are not repeated;
+    ``shown`` maps partly shown chunks to how many leading words are on screen, and a
+    hit on one keeps only the rest. Leftover budget goes to the start of the following
+    chunk, where a cut-off story continues; that chunk is returned as the tail (row,
+    words shown) instead of counting as shown. Returns (text, first row, last row, tail).
+    """
+    previous, following = _neighbour_links(data)
+    chunks = data["chunks"]
+
+    def free(position: int) -> bool:
+        return position >= 0 and position not in used and position not in shown
+
+    words = chunks[row]["text"].split()[shown.get(row, 0) :]
+    first = last = row
+    grew = True
+    while grew:
+        grew = False
+        after = int(following[last])
+        if free(after):
+            merged = _merge_words(words, chunks[after]["text"].split())
+            if len(merged) <= budget:
+                words, last, grew = merged, after, True
+        before = int(previous[first])
+        if free(before):
+            merged = _merge_words(chunks[before]["text"].split(), words)
+            if len(merged) <= budget:
+                words, first, grew = merged, before, True
+    tail = None
+    after = int(following[last])
+    if free(after) and len(words) < budget:
+        after_words = chunks[after]["text"].split()
+        merged = _merge_words(words, after_words)
+        filled = merged[:budget]
+        if len(filled) > len(words):
+            # Words cut off the end of ``merged`` all belong to ``after``
+            tail = (after, len(after_words) - (len(merged) - len(filled)))
+            words = filled
+    return " ".join(words), first, last, tail
+
+
+def _format_results(
+    data: Dict[str, np.ndarray],
+    rows: Sequence[int],
+    scores: Sequence[float],
+    expand_words: Optional[int] = None,
+) -> List[Dict[str, str]]:
+    """Result dicts for ranked rows, optionally expanded into neighbouring chunks.
+
+    With ``expand_words``, a hit already contained in a better hit's expansion is dropped
+    and one whose start was shown as a better hit's tail keeps only the rest; ``ordinals``
+    cover the fully shown chunks. ``start``/``end`` stay the matched chunk's span.
+    """
+    chunks = data["chunks"]
+    if not expand_words:
+        return [_format_result(chunks[int(row)], score) for row, score in zip(rows, scores)]
+
+    _, following = _neighbour_links(data)
     results = []
-    for idx in top_indices:
-        chunk = chunks[int(idx)]
+    used: set = set()
+    shown: Dict[int, int] = {}
+    for row, score in zip(rows, scores):
+        row = int(row)
+        if row in used:
+            continue
+        text, first, last, tail = _expand_hit(data, row, expand_words, used, shown)
+        position = first
+        while True:
+            used.add(position)
+            shown.pop(position, None)
+            if position == last:
+                break
+            position = int(following[position])
+        if tail is not None:
+            shown[tail[0]] = tail[1]
         results.append(
             {
-                "score": float(scores[int(idx)]),
-                "source": chunk["source"],
-                "text": chunk["text"],
+                **_format_result(chunks[row], score),
+                "text": text,
+                "ordinals": [int(data["ordinals"][first]), int(data["ordinals"][last])],
             }
         )
     return results
 
 
+def search_by_embeddings(
+    query_embeddings: Sequence[Sequence[float]],
+    top_k: int = 3,
+    source_filter: Optional[Sequence[Optional[Sequence[str]]]] = None,
+    filters: Optional[Dict[str, object]] = None,
+    boost: Optional[Dict[str, object]] = None,
+    boost_weight: float = DEFAULT_BOOST_WEIGHT,
+    mmr_lambda: Optional[float] = None,
+    max_per_source: Optional[int] = None,
+    rescore_factor: int = DEFAULT_RESCORE_FACTOR,
+    nprobe: int = ann_index.DEFAULT_NPROBE,
+    expand_words: Optional[int] = None,
+) -> List[List[Dict[str, str]]]:
+    """Score a whole batch of query vectors with one matrix product.
+
+    ``source_filter`` holds one entry per query: ``None`` searches everything,
+    otherwise a list of source paths the results must come from. ``filters``
+    applies to every query and may combine ``source`` (glob), ``collection``,
+    ``title`` and ``year`` (int or [start, end]). Rows matching ``boost`` (same
+    keys) gain ``boost_weight`` cosine. ``mmr_lambda`` re-ranks for diversity and
+    ``max_per_source`` caps hits from any one document. ``expand_words`` merges
+    each hit with its neighbouring chunks up to that many words.
+    """
+    data = _load_index()
+
+    queries = np.array(query_embeddings, dtype=np.float32)
+    if queries.ndim == 1:
+        queries = queries[None, :]
+    if _index_width(data) == 0 or queries.size == 0:
+        return [[] for _ in range(len(queries))]
+    if source_filter is not None and len(source_filter) != len(queries):
+        raise ValueError("source_filter needs one entry per query row.")
+
+    queries, valid = _prepare_queries(data, queries)
+    masks = _combine_masks(data, len(queries), source_filter, filters)
+    bonus = _boost_bonus(data, boost, boost_weight)
+
+    diversify = mmr_lambda is not None or bool(max_per_source)
+    fetch_k = top_k * MMR_POOL_FACTOR if diversify else top_k
+    top_indices, top_scores = _search_index(data, queries, fetch_k, rescore_factor, masks, nprobe, bonus)
+
+    batch_results = []
+    for row_valid, row_indices, row_scores in zip(valid, top_indices, top_scores):
+        results = []
+        if row_valid:
+            finite = np.isfinite(row_scores)
+            row_indices, row_scores = row_indices[finite], row_scores[finite]
+            if diversify:
+                order = _diversify(data, row_indices, row_scores, top_k, mmr_lambda, max_per_source)
+                row_indices, row_scores = row_indices[order], row_scores[order]
+            results = _format_results(data, row_indices, row_scores, expand_words)
+        batch_results.append(results)
+    return batch_results
+
+
+def search_by_embedding(
+    query_embedding: List[float],
+    top_k: int = 3,
+    filters: Optional[Dict[str, object]] = None,
+    boost: Optional[Dict[str, object]] = None,
+    boost_weight: float = DEFAULT_BOOST_WEIGHT,
+    mmr_lambda: Optional[float] = None,
+    max_per_source: Optional[int] = None,
+    rescore_factor: int = DEFAULT_RESCORE_FACTOR,
+    nprobe: int = ann_index.DEFAULT_NPROBE,
+    expand_words: Optional[int] = None,
+) -> List[Dict[str, str]]:
+    return search_by_embeddings(
+        [query_embedding],
+        top_k=top_k,
+        filters=filters,
+        boost=boost,
+        boost_weight=boost_weight,
+        mmr_lambda=mmr_lambda,
+        max_per_source=max_per_source,
+        rescore_factor=rescore_factor,
+        nprobe=nprobe,
+        expand_words=expand_words,
+    )[0]
+
+
+def _lexical(data: Dict[str, np.ndarray]) -> Dict[str, object]:
+    # JSONL and pre-lexical binary indexes get an in-memory inverted index on first use
+    if "lexical" not in data:
+        data["lexical"] = lexical_index.in_memory_lexical_index([chunk["text"] for chunk in data["chunks"]])
+    return data["lexical"]
+
+
+def _bm25_scores(data: Dict[str, np.ndarray], query_text: str) -> np.ndarray:
+    """BM25 per global row; each shard scores with its own term statistics."""
+    if "shards" in data:
+        return np.concatenate([_bm25_scores(shard, query_text) for shard in data["shards"]])
+    return lexical_index.bm25_scores(_lexical(data), query_text)
+
+
+def _lexical_ranking(
+    data: Dict[str, np.ndarray],
+    query_text: str,
+    limit: int,
+    mask: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Top BM25 rows for a query, with chunks containing every quoted phrase ranked first."""
+    scores = _bm25_scores(data, query_text)
+    if mask is not None:
+        scores[~mask] = 0
+    matched = np.flatnonzero(scores > 0)
+    if matched.size == 0:
+        return matched, scores[matched]
+
+    phrases = [lexical_index.phrase_matcher(phrase) for phrase in lexical_index.quoted_phrases(query_text)]
+    if phrases:
+        # Phrase checks only touch the BM25 shortlist, never the whole corpus
+        shortlist = matched[_top_indices(scores[matched][None, :], limit * 4)[0]]
+        boost = float(scores.max())
+        for idx in shortlist:
+            text = data["chunks"][int(idx)]["text"]
+            if all(phrase.search(text) for phrase in phrases):
+                scores[idx] += boost
+        matched = shortlist
+
+    order = _top_indices(scores[matched][None, :], limit)[0]
+    return matched[order], scores[matched[order]]
+
+
+def search_lexical(
+    query_text: str,
+    top_k: int = 3,
+    filters: Optional[Dict[str, object]] = None,
+    expand_words: Optional[int] = None,
+) -> List[Dict[str, str]]:
+    """BM25-only search; needs no query embedding."""
+    data = _load_index()
+    if not data["chunks"]:
+        return []
+    indices, scores = _lexical_ranking(data, query_text, top_k, _filter_mask(data, filters))
+    return _format_results(data, indices, scores, expand_words)
+
+
+def search_hybrid(
+    query_text: str,
+    query_embedding: Optional[Sequence[float]] = None,
+    top_k: int = 3,
+    candidates: int = HYBRID_CANDIDATES,
+    rrf_k: int = RRF_K,
+    filters: Optional[Dict[str, object]] = None,
+    boost: Optional[Dict[str, object]] = None,
+    boost_weight: float = DEFAULT_BOOST_WEIGHT,
+    mmr_lambda: Optional[float] = None,
+    max_per_source: Optional[int] = None,
+    expand_words: Optional[int] = None,
+) -> List[Dict[str, str]]:
+    """Fuse BM25 and cosine rankings with reciprocal rank fusion.
+
+    Falls back to lexical-only search when no embedding is supplied. The returned
+    score is the fused RRF score, not a cosine similarity. ``boost`` nudges the
+    cosine ranking only; diversity options apply to the fused ranking.
+    """
+    if query_embedding is None:
+        return search_lexical(query_text, top_k=top_k, filters=filters, expand_words=expand_words)
+
+    data = _load_index()
+    if _index_width(data) == 0:
+        return []
+
+    queries, valid = _prepare_queries(data, np.array(query_embedding, dtype=np.float32)[None, :])
+    if not valid[0]:
+        return search_lexical(query_text, top_k=top_k, filters=filters, expand_words=expand_words)
+
+    mask = _filter_mask(data, filters)
+    vector_indices, vector_scores = _search_index(
+        data,
+        queries,
+        candidates,
+        masks=None if mask is None else mask[None, :],
+        bonus=_boost_bonus(data, boost, boost_weight),
+    )
+    lexical_indices, _ = _lexical_ranking(data, query_text, candidates, mask)
+
+    fused: Dict[int, float] = {}
+    for ranking in (vector_indices[0][np.isfinite(vector_scores[0])], lexical_indices):
+        for rank, idx in enumerate(ranking):
+            fused[int(idx)] = fused.get(int(idx), 0.0) + 1.0 / (rrf_k + rank + 1)
+
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    rows = np.array([idx for idx, _ in ranked], dtype=np.int64)
+    fused_scores = np.array([score for _, score in ranked], dtype=np.float32)
+    if mmr_lambda is not None or max_per_source:
+        # RRF scores are tiny; rescale to [0, 1] so they trade off against cosine overlap
+        relevance = fused_scores / fused_scores.max() if len(ranked) else fused_scores
+        order = _diversify(data, rows, relevance, top_k, mmr_lambda, max_per_source)
+    else:
+        order = np.arange(min(top_k, len(ranked)))
+    return _format_results(data, rows[order], fused_scores[order], expand_words)
+
+
+_async_pool: Optional[ThreadPoolExecutor] = None
+_async_pool_lock = threading.Lock()
+
+
+def _async_executor() -> ThreadPoolExecutor:
+    global _async_pool
+    with _async_pool_lock:
+        if _async_pool is None:
+            _async_pool = ThreadPoolExecutor(max_workers=ASYNC_SEARCH_THREADS, thread_name_prefix="corpus-search")
+        return _async_pool
+
+
+async def _offload(function, *args, **kwargs):
+    """Run a blocking search on the bounded executor so the event loop keeps serving.
+
+    Cancelling the awaiting task returns immediately; a search already running
+    finishes in its thread and its result is dropped.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_async_executor(), functools.partial(function, *args, **kwargs))
+
+
+async def asearch(query_embedding: Sequence[float], **options) -> List[Dict[str, str]]:
+    """Awaitable search_by_embedding; index (re)loads also happen off the event loop."""
+    return await _offload(search_by_embedding, query_embedding, **options)
+
+
+async def asearch_lexical(query_text: str, **options) -> List[Dict[str, str]]:
+    return await _offload(search_lexical, query_text, **options)
+
+
+async def asearch_hybrid(query_text: str, query_embedding: Sequence[float], **options) -> List[Dict[str, str]]:
+    return await _offload(search_hybrid, query_text, query_embedding, **options)
+
+
 def clear_cache() -> None:
-    _load_index.cache_clear()
+    """Force the next search to reload the index from disk."""
+    with _reload_lock:
+        _state.update(data=None, fingerprint=None, checked=0.0)
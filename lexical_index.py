@@ -0,0 +1,110 @@
+"""BM25 inverted index over corpus chunks for exact-phrase and name lookups."""
+
+from __future__ import annotations
+
+import re
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# Standard Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+PHRASE_PATTERN = re.compile(r"[\"“”]([^\"“”]+)[\"“”]")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; hyphens and periods split ("Ice-nine" -> ice, nine)."""
+    return TOKEN_PATTERN.findall((text or "").lower().replace("'", "").replace("’", ""))
+
+
+def quoted_phrases(query: str) -> List[List[str]]:
+    """Token sequences for every "quoted phrase" in a query."""
+    return [tokens for tokens in (tokenize(p) for p in PHRASE_PATTERN.findall(query or "")) if len(tokens) > 1]
+
+
+def build_lexical_index(texts: Sequence[str]) -> Dict[str, np.ndarray]:
+    """Build CSR-style postings with precomputed BM25 weights.
+
+    Postings for term ``t`` are ``doc_ids[offsets[t]:offsets[t + 1]]`` with matching
+    ``weights``, so a query is a handful of slice-and-add operations.
+    """
+    # One (term, doc) pair per token in flat int arrays; dicts per posting cost ~100 bytes each
+    vocabulary: Dict[str, int] = {}
+    token_ids: List[int] = []
+    doc_lengths = np.zeros(len(texts), dtype=np.int32)
+    for doc_id, text in enumerate(texts):
+        tokens = tokenize(text)
+        doc_lengths[doc_id] = len(tokens)
+        token_ids.extend(vocabulary.setdefault(token, len(vocabulary)) for token in tokens)
+
+    # Renumber terms alphabetically, then sort (term, doc) keys to get CSR order and tf counts
+    n_docs = max(1, len(texts))
+    terms = sorted(vocabulary)
+    rank = np.zeros(len(terms), dtype=np.int64)
+    rank[[vocabulary[term] for term in terms]] = np.arange(len(terms))
+    doc_of_token = np.repeat(np.arange(len(texts), dtype=np.int64), doc_lengths)
+    keys, tfs = np.unique(rank[np.asarray(token_ids, dtype=np.int64)] * n_docs + doc_of_token, return_counts=True)
+    doc_ids = (keys % n_docs).astype(np.int32)
+    tfs = tfs.astype(np.int32)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(keys // n_docs, minlength=len(terms)))
+
+    avgdl = float(doc_lengths.mean()) if len(texts) else 1.0
+    df = np.diff(offsets).astype(np.float32)
+    idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+    posting_idf = np.repeat(idf, np.diff(offsets))
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[doc_ids] / max(avgdl, 1e-9))
+    weights = posting_idf * tfs * (BM25_K1 + 1) / (tfs + length_norm)
+
+    return {
+        "terms": np.array(terms, dtype=str),
+        "offsets": offsets,
+        "doc_ids": doc_ids,
+        "tfs": tfs,
+        "weights": weights.astype(np.float32),
+        "doc_lengths": doc_lengths,
+    }
+
+
+def save_lexical_index(index: Dict[str, np.ndarray], path: Path) -> None:
+    with path.open("wb") as f:
+        np.savez(f, **index)
+
+
+def load_lexical_index(path: Path) -> Dict[str, object]:
+    with np.load(path, allow_pickle=False) as archive:
+        index: Dict[str, object] = {key: archive[key] for key in archive.files}
+    return _with_vocabulary(index)
+
+
+def _with_vocabulary(index: Dict[str, object]) -> Dict[str, object]:
+    index["vocabulary"] = {term: pos for pos, term in enumerate(index["terms"].tolist())}
+    return index
+
+
+def in_memory_lexical_index(texts: Sequence[str]) -> Dict[str, object]:
+    return _with_vocabulary(build_lexical_index(texts))
+
+
+def bm25_scores(index: Dict[str, object], query: str) -> np.ndarray:
+    """BM25 score of every chunk for ``query`` (zeros where no term matches)."""
+    scores = np.zeros(len(index["doc_lengths"]), dtype=np.float32)
+    offsets = index["offsets"]
+    for token in set(tokenize(query)):
+        pos = index["vocabulary"].get(token)
+        if pos is None:
+            continue
+        start, end = offsets[pos], offsets[pos + 1]
+        # Each doc appears once per term, so plain fancy-index addition is safe
+        scores[index["doc_ids"][start:end]] += index["weights"][start:end]
+    return scores
+
+
+def phrase_matcher(phrase: Sequence[str]) -> "re.Pattern[str]":
+    """Regex matching the phrase tokens in raw text, separated by any non-word run."""
+    body = r"[^a-z0-9]+".join(re.escape(token) for token in phrase)
+    return re.compile(rf"(?<![a-z0-9]){body}(?![a-z0-9])", re.IGNORECASE)
@@ -0,0 +1,102 @@
+"""Near-duplicate chunk detection with MinHash signatures and LSH banding in pure NumPy.
+
+Each text becomes a set of word shingles. MinHash signatures estimate the Jaccard
+similarity of two sets, and splitting the signatures into bands (texts that agree
+on every row of some band share a bucket) turns the all-pairs comparison into a
+bucket lookup. Candidate pairs are confirmed with the exact shingle Jaccard, so
+the groups never depend on a lucky hash.
+"""
+
+from __future__ import annotations
+
+import zlib
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+import lexical_index
+
+SHINGLE_WORDS = 5
+NUM_PERMUTATIONS = 128
+# 32 bands of 4 rows: pairs from about Jaccard 0.42 up become candidates
+LSH_BANDS = 32
+# Chunks cut from the same text a few words apart score about 0.75
+DEFAULT_THRESHOLD = 0.7
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> np.ndarray:
+    """Sorted unique crc32 hashes of the text's ``size``-word shingles."""
+    tokens = lexical_index.tokenize(text)
+    if not tokens:
+        return np.zeros(0, dtype=np.uint32)
+    grams = [" ".join(tokens[i : i + size]) for i in range(max(1, len(tokens) - size + 1))]
+    return np.unique(np.array([zlib.crc32(gram.encode("utf-8")) for gram in grams], dtype=np.uint32))
+
+
+def minhash_signatures(
+    shingle_sets: Sequence[np.ndarray],
+    num_permutations: int = NUM_PERMUTATIONS,
+    seed: int = 0,
+) -> np.ndarray:
+    """(texts x num_permutations) uint32 MinHash signatures; empty sets get all-max rows."""
+    rng = np.random.default_rng(seed)
+    # Multiply-shift hashing: the top 32 bits of (a * x + b) mod 2**64 with odd a
+    multipliers = rng.integers(0, 2**63, size=num_permutations, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    offsets = rng.integers(0, 2**63, size=num_permutations, dtype=np.uint64)
+    signatures = np.full((len(shingle_sets), num_permutations), np.iinfo(np.uint32).max, dtype=np.uint32)
+    for row, values in enumerate(shingle_sets):
+        if values.size:
+            hashed = (values.astype(np.uint64)[:, None] * multipliers + offsets) >> np.uint64(32)
+            signatures[row] = hashed.min(axis=0)
+    return signatures
+
+
+def candidate_pairs(signatures: np.ndarray, bands: int = LSH_BANDS) -> List[Tuple[int, int]]:
+    """Row pairs that agree on every row of at least one band."""
+    rows_per_band = signatures.shape[1] // bands
+    pairs = set()
+    for band in range(bands):
+        buckets: Dict[bytes, List[int]] = {}
+        block = np.ascontiguousarray(signatures[:, band * rows_per_band : (band + 1) * rows_per_band])
+        for row in range(block.shape[0]):
+            buckets.setdefault(block[row].tobytes(), []).append(row)
+        for members in buckets.values():
+            pairs.update((a, b) for pos, a in enumerate(members) for b in members[pos + 1 :])
+    return sorted(pairs)
+
+
+def jaccard(left: np.ndarray, right: np.ndarray) -> float:
+    """Exact Jaccard similarity of two sorted unique shingle arrays."""
+    if not left.size or not right.size:
+        return 0.0
+    shared = np.intersect1d(left, right, assume_unique=True).size
+    return shared / (left.size + right.size - shared)
+
+
+def duplicate_groups(texts: Sequence[str], threshold: float = DEFAULT_THRESHOLD) -> List[List[int]]:
+    """Groups (two or more text positions, ascending) whose shingle Jaccard reaches ``threshold``.
+
+    Groups are connected components, so A~B and B~C put A, B and C together even if
+    A and C alone fall just short of the threshold.
+    """
+    sets = [shingles(text) for text in texts]
+    signatures = minhash_signatures(sets)
+    empty = [not values.size for values in sets]
+    parent = list(range(len(texts)))
+
+    def find(node: int) -> int:
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for a, b in candidate_pairs(signatures):
+        if empty[a] or empty[b] or find(a) == find(b):
+            continue
+        if jaccard(sets[a], sets[b]) >= threshold:
+            parent[max(find(a), find(b))] = min(find(a), find(b))
+
+    groups: Dict[int, List[int]] = {}
+    for node in range(len(texts)):
+        groups.setdefault(find(node), []).append(node)
+    return [members for members in groups.values() if len(members) > 1]
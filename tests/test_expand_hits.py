@@ -0,0 +1,46 @@
+"""Neighbour expansion must not repeat text, nor drop a hit on a partly shown chunk."""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import knowledge_base  # noqa: E402
+
+
+def _words(start: int, end: int) -> str:
+    return " ".join(f"w{i}" for i in range(start, end))
+
+
+def _document() -> dict:
+    # Three consecutive chunks of one source, each overlapping the next by two words
+    texts = [_words(0, 10), _words(8, 18), _words(16, 26)]
+    return {
+        "chunks": [{"id": f"doc-chunk-{i}", "source": "doc.txt", "text": text} for i, text in enumerate(texts)],
+        "source_ids": np.zeros(3, dtype=np.int32),
+        "ordinals": np.arange(3, dtype=np.int32),
+    }
+
+
+def test_hit_on_partly_filled_chunk_shows_the_rest():
+    results = knowledge_base._format_results(_document(), [0, 1], [0.9, 0.8], expand_words=14)
+
+    assert len(results) == 2
+    # The first hit fills its budget with the start of chunk 1 without claiming it
+    assert results[0]["text"] == _words(0, 14)
+    assert results[0]["ordinals"] == [0, 0]
+    # The later hit on chunk 1 keeps only its unshown words, then grows into chunk 2
+    assert results[1]["text"] == _words(14, 26)
+    assert results[1]["ordinals"] == [1, 2]
+    shown = [word for result in results for word in result["text"].split()]
+    assert len(shown) == len(set(shown))
+
+
+def test_hit_inside_a_better_expansion_is_dropped():
+    results = knowledge_base._format_results(_document(), [1, 0, 2], [0.9, 0.8, 0.7], expand_words=30)
+
+    assert len(results) == 1
+    assert results[0]["text"] == _words(0, 26)
+    assert results[0]["ordinals"] == [0, 2]
@@ -0,0 +1,158 @@
+"""Pluggable text extraction for corpus source files other than plain text.
+
+An extractor takes a path and yields the document's text one piece at a time (a
+PDF page, an EPUB chapter, a whole HTML file), so a large document is never held
+in memory at once. ``register`` maps file suffixes to extractors. Extracted text
+is cached under the file's SHA-256, so each file is parsed once however often the
+index is rebuilt.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # PDF ingestion is optional
+    PdfReader = None
+
+EXTRACTION_CACHE_DIR = Path(os.getenv("CORPUS_EXTRACTION_CACHE", "data/cache/extracted"))
+# Bump when an extractor's output changes so cached text is re-extracted
+EXTRACTION_VERSION = 1
+HASH_BLOCK_BYTES = 1 << 20
+
+Extractor = Callable[[Path], Iterator[str]]
+EXTRACTORS: Dict[str, Extractor] = {}
+
+
+class ExtractionError(RuntimeError):
+    """A file could not be extracted (unreadable, or its extractor's dependency is missing)."""
+
+
+def register(*suffixes: str) -> Callable[[Extractor], Extractor]:
+    """Decorator registering an extractor for file suffixes such as ".pdf"."""
+
+    def decorate(extractor: Extractor) -> Extractor:
+        for suffix in suffixes:
+            EXTRACTORS[suffix.lower()] = extractor
+        return extractor
+
+    return decorate
+
+
+def file_digest(path: Path) -> str:
+    """SHA-256 of the file's bytes, read in blocks."""
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class _TextCollector(HTMLParser):
+    """Visible text of an (X)HTML document, with line breaks at block elements."""
+
+    SKIP = {"script", "style", "head", "title", "noscript"}
+    BLOCKS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "section"}
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs) -> None:
+        if tag in self.SKIP:
+            self.skipping += 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag) -> None:
+        if tag in self.SKIP and self.skipping:
+            self.skipping -= 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_data(self, data) -> None:
+        if not self.skipping:
+            self.parts.append(data)
+
+
+def html_to_text(markup: str) -> str:
+    collector = _TextCollector()
+    collector.feed(markup)
+    collector.close()
+    return "".join(collector.parts)
+
+
+@register(".pdf")
+def extract_pdf(path: Path) -> Iterator[str]:
+    """One page of text at a time; scanned pages without a text layer yield ''."""
+    if PdfReader is None:
+        raise ExtractionError(f"Install pypdf to index {path}.")
+    # pypdf warns about every font it cannot fully decode; the text is still usable
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+    reader = PdfReader(str(path))
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+
+@register(".html", ".htm", ".xhtml")
+def extract_html(path: Path) -> Iterator[str]:
+    yield html_to_text(path.read_text(encoding="utf-8", errors="ignore"))
+
+
+@register(".epub")
+def extract_epub(path: Path) -> Iterator[str]:
+    """Chapters in reading (spine) order, one at a time."""
+    with zipfile.ZipFile(path) as book:
+        container = ET.fromstring(book.read("META-INF/container.xml"))
+        rootfile = next(el for el in container.iter() if el.tag.endswith("rootfile")).get("full-path")
+        package = ET.fromstring(book.read(rootfile))
+        base = posixpath.dirname(rootfile)
+        items = {el.get("id"): el.get("href") for el in package.iter() if el.tag.endswith("}item")}
+        for itemref in (el for el in package.iter() if el.tag.endswith("}itemref")):
+            href = items.get(itemref.get("idref"))
+            if href:
+                yield html_to_text(book.read(posixpath.join(base, href)).decode("utf-8", errors="ignore"))
+
+
+def extracted_pieces(path: Path, digest: str, cache_dir: Path = EXTRACTION_CACHE_DIR) -> Iterator[str]:
+    """Text pieces of ``path``: from the cache when ``digest`` was extracted before.
+
+    A fresh extraction is written to the cache piece by piece and published with a
+    rename once complete, so an interrupted run never leaves a truncated entry.
+    Cached text is streamed back line by line.
+    """
+    cached = cache_dir / f"{digest}.v{EXTRACTION_VERSION}.txt"
+    if cached.exists():
+        # newline="" keeps offsets into cached text identical to a fresh extraction
+        with cached.open("r", encoding="utf-8", newline="") as f:
+            yield from f
+        return
+    extractor = EXTRACTORS.get(path.suffix.lower())
+    if extractor is None:
+        raise ExtractionError(f"No extractor registered for {path.suffix!r} files.")
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = cached.with_name(f".{cached.name}.{os.getpid()}.tmp")
+    try:
+        with tmp_path.open("w", encoding="utf-8", newline="") as f:
+            for piece in extractor(path):
+                piece = piece if piece.endswith("\n") else piece + "\n"
+                f.write(piece)
+                yield piece
+        os.replace(tmp_path, cached)
+    except ExtractionError:
+        raise
+    except Exception as exc:
+        # Parsers raise their own error types on damaged files; report them uniformly
+        raise ExtractionError(f"Could not extract {path}: {exc}") from exc
+    finally:
+        tmp_path.unlink(missing_ok=True)
@@ -3,33 +3,44 @@ Vonnebot LiveKit Agent with Simli Avatar
 A Kurt Vonnegut-inspired reading companion powered by LiveKit + Simli + RAG
 """
 
+import asyncio
 import logging
 import os
-import json
 from pathlib import Path
 from typing import List, Dict
 
 from dotenv import load_dotenv
-import numpy as np
 from livekit.agents import (
     Agent,
     AgentSession,
     JobContext,
+    JobProcess,
     WorkerOptions,
     WorkerType,
     cli,
 )
+from livekit.agents.llm import ChatContext, ChatMessage
 from livekit.plugins import openai, simli
 
+import embedding_providers
+import knowledge_base
+
 load_dotenv(override=True)
 
 logger = logging.getLogger("vonnebot-agent")
 logger.setLevel(logging.INFO)
 
 # Paths
-INDEX_PATH = Path("data/corpus_index.jsonl")
 PROMPT_PATH = Path("prompts_base_prompt.txt")
 
+# Retrieval config
+CORPUS_EMBEDDING_MODEL = os.getenv("CORPUS_EMBEDDING_MODEL", "text-embedding-3-large")
+CORPUS_EMBEDDING_DIMENSIONS = int(os.getenv("CORPUS_EMBEDDING_DIMENSIONS", "0"))
+CORPUS_CONTEXT_WORDS = int(os.getenv("CORPUS_CONTEXT_WORDS", "400"))
+# A spoken reply can't wait long for references; past this, fall back to keyword search
+CORPUS_EMBED_TIMEOUT_SECONDS = float(os.getenv("CORPUS_EMBED_TIMEOUT_SECONDS", "1.5"))
+RAG_TOP_K = 3
+
 # Load the Vonnegut system prompt
 def load_system_prompt() -> str:
     """Load the base Vonnegut persona prompt."""
@@ -39,66 +50,66 @@ def load_system_prompt() -> str:
 
 
 # RAG Knowledge Base Functions
-def load_index() -> Dict:
-    """Load the corpus index for RAG retrieval."""
-    if not INDEX_PATH.exists():
-        logger.warning("Corpus index not found at %s", INDEX_PATH)
-        return {"embeddings": np.zeros((0, 0)), "chunks": []}
-
-    embeddings: List[List[float]] = []
-    chunks: List[Dict[str, str]] = []
-
-    with INDEX_PATH.open("r", encoding="utf-8") as f:
-        for line in f:
-            record = json.loads(line)
-            chunks.append({
-                "id": record.get("id"),
-                "source": record.get("source"),
-                "text": record.get("text"),
-            })
-            embeddings.append(record["embedding"])
-
-    if not embeddings:
-        return {"embeddings": np.zeros((0, 0)), "chunks": []}
-
-    vectors = np.array(embeddings, dtype=np.float32)
-    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
-    norms[norms == 0] = 1
-    normalized = vectors / norms
-    return {"embeddings": normalized, "chunks": chunks}
-
-
-def search_corpus(query_embedding: List[float], top_k: int = 3) -> List[Dict[str, str]]:
-    """Search the Vonnegut corpus using embedding similarity."""
-    data = load_index()
-    embeddings = data["embeddings"]
-    chunks = data["chunks"]
-
-    if embeddings.size == 0:
+_query_provider = None
+
+
+def query_provider():
+    """Embedding provider matching the loaded index (blocking; may load the index)."""
+    global _query_provider
+    local_embedder = knowledge_base.query_embedder()
+    if local_embedder is not None:
+        return local_embedder
+    # Only text-embedding-3 models accept a dimensions argument
+    dimensions = CORPUS_EMBEDDING_DIMENSIONS or knowledge_base.index_dimensions()
+    if "embedding-3" not in CORPUS_EMBEDDING_MODEL:
+        dimensions = None
+    # A hot-reloaded index may have a different width, so rebuild the provider to match it
+    if _query_provider is None or _query_provider.requested_dimensions != (dimensions or None):
+        _query_provider = embedding_providers.OpenAIProvider(CORPUS_EMBEDDING_MODEL, dimensions or None)
+    return _query_provider
+
+
+async def retrieve_references(query_text: str, top_k: int = RAG_TOP_K) -> List[Dict[str, str]]:
+    """Hybrid corpus search for a user turn without blocking the event loop.
+
+    The query embedding is fetched with a deadline; on timeout or API error the
+    turn still gets keyword (BM25) matches. knowledge_base picks up rebuilt
+    indexes on its own, so a long-running agent worker serves new corpora
+    without a restart.
+    """
+    if not knowledge_base.index_available():
+        logger.warning("Corpus index not found at %s", knowledge_base.INDEX_PATH)
         return []
+    options = {"top_k": top_k, "expand_words": CORPUS_CONTEXT_WORDS or None}
+    provider = await asyncio.to_thread(query_provider)
+    try:
+        embedding = await embedding_providers.aembed(provider, [query_text], CORPUS_EMBED_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning("Query embedding timed out after %.1fs; using keyword search", CORPUS_EMBED_TIMEOUT_SECONDS)
+        return await knowledge_base.asearch_lexical(query_text, **options)
+    except Exception as exc:
+        logger.warning("Query embedding failed (%s); using keyword search", exc)
+        return await knowledge_base.asearch_lexical(query_text, **options)
+    return await knowledge_base.asearch_hybrid(query_text, embedding[0].tolist(), **options)
+
+
+def format_references(snippets: List[Dict[str, str]]) -> str:
+    excerpts = "\n\n".join(f"Source: {snippet['source']}\nExcerpt: {snippet['text'].strip()}" for snippet in snippets)
+    return (
+        "Reference these authentic Vonnegut materials when you respond. "
+        "Focus on consistency with the cited excerpts.\n\n" + excerpts
+    )
 
-    query_vec = np.array(query_embedding, dtype=np.float32)
-    q_norm = np.linalg.norm(query_vec)
-    if q_norm == 0:
-        return []
-    query_vec = query_vec / q_norm
-
-    scores = embeddings @ query_vec
-    if top_k >= len(chunks):
-        top_indices = np.argsort(scores)[::-1]
-    else:
-        top_indices = np.argpartition(scores, -top_k)[-top_k:]
-        top_indices = top_indices[np.argsort(scores[top_indices])[::-1]]
-
-    results = []
-    for idx in top_indices:
-        chunk = chunks[int(idx)]
-        results.append({
-            "score": float(scores[int(idx)]),
-            "source": chunk["source"],
-            "text": chunk["text"],
-        })
-    return results
+
+class VonnebotAgent(Agent):
+    async def on_user_turn_completed(self, turn_ctx: ChatContext, new_message: ChatMessage) -> None:
+        """Add corpus excerpts for the finished user turn before the reply is generated."""
+        query_text = new_message.text_content
+        if not query_text:
+            return
+        snippets = await retrieve_references(query_text)
+        if snippets:
+            turn_ctx.add_message(role="assistant", content=format_references(snippets))
 
 
 # Build the full system prompt with RAG context
@@ -106,13 +117,17 @@ def build_prompt_with_context(user_message: str = None) -> str:
     """Build system prompt, optionally with RAG context."""
     base_prompt = load_system_prompt()
 
-    # For now, return base prompt
-    # RAG integration would require async embedding call
-    # which we can add via a custom LLM wrapper later
+    # Per-turn corpus excerpts are added by VonnebotAgent.on_user_turn_completed
 
     return base_prompt
 
 
+def prewarm(proc: JobProcess) -> None:
+    """Load the corpus index once per worker process, before any session starts."""
+    if knowledge_base.index_available():
+        knowledge_base.preload_index()
+
+
 # Main entrypoint
 async def entrypoint(ctx: JobContext):
     """LiveKit agent entrypoint."""
@@ -150,7 +165,7 @@ async def entrypoint(ctx: JobContext):
     await simli_avatar.start(session, room=ctx.room)
 
     # Create the agent with Vonnegut instructions
-    agent = Agent(
+    agent = VonnebotAgent(
         instructions=system_prompt,
     )
 
@@ -167,6 +182,7 @@ if __name__ == "__main__":
     cli.run_app(
         WorkerOptions(
             entrypoint_fnc=entrypoint,
+            prewarm_fnc=prewarm,
             worker_type=WorkerType.ROOM,
         )
     )